@@ -22,6 +22,10 @@ setup(
         "Programming Language :: Python :: 3.6"],
     install_requires=[
         'attrs'],
+    extras_require={
+        'arrow': [
+            'numpy>=1.17',
+            'pyarrow']},
     package_data={
         'bounced': [
             'tests/*.py',
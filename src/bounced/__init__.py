@@ -1,11 +1,17 @@
 from .bounced import Bounce
 from .bounced import DSN
+from .bounced import LimitExceeded
+from .bounced import Limits
 from .bounced import get_bounces
+from .bounced import get_bounces_from_bytes
 from .bounced import get_delivery_status
 
 
 __all__ = [
     Bounce,
     DSN,
+    LimitExceeded,
+    Limits,
     get_bounces,
+    get_bounces_from_bytes,
     get_delivery_status]
@@ -0,0 +1,54 @@
+from .cache import memoize
+try:
+    from sys import intern
+except ImportError:  # pragma: no cover
+    import __builtin__
+
+    def intern(value):
+        # only byte strings can be interned on Python 2
+        if isinstance(value, str):
+            return __builtin__.intern(value)
+        return value
+
+
+# maximum number of distinct addresses remembered
+ADDRESS_CACHE_SIZE = 65536
+
+
+def normalize_domain(domain):
+    domain = domain.rstrip('.').lower()
+    try:
+        domain.encode('ascii')
+    except UnicodeEncodeError:
+        try:
+            return domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            # not a valid internationalized domain name, keep it readable
+            return domain
+    except UnicodeDecodeError:  # pragma: no cover
+        # undecoded byte string on Python 2
+        return domain
+    return domain
+
+
+@memoize(ADDRESS_CACHE_SIZE)
+def normalize_address(address):
+    # The domain is lowercased and IDNA encoded, the local part is case
+    # sensitive and kept as is. The result is interned, so equal
+    # addresses share one string.
+    address = address.strip()
+    if '@' not in address and '(a)' in address:
+        # x400 gateways can't represent the at sign
+        address = address.replace('(a)', '@')
+    (local, sep, domain) = address.rpartition('@')
+    if sep:
+        address = local + sep + normalize_domain(domain)
+    return intern(address)
+
+
+def normalize_recipient(recipient):
+    # for the (name, addr) tuples returned by email.utils.parseaddr
+    if recipient is None:
+        return
+    (name, addr) = recipient
+    return (intern(name), normalize_address(addr))
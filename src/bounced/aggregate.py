@@ -0,0 +1,281 @@
+from .store import get_domain
+from .store import normalize_address
+import array
+import base64
+import collections
+import hashlib
+import math
+
+
+def encode_key(key):
+    if isinstance(key, bytes):
+        return key
+    return key.encode('utf-8', 'surrogateescape')
+
+
+def get_status_class(status):
+    if status and status[0] in '245':
+        return '%sxx' % status[0]
+    return 'unknown'
+
+
+class HyperLogLog(object):
+    # Estimates the number of distinct values with a relative error of
+    # about 1.04 / sqrt(2 ** precision), using 2 ** precision bytes.
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        digest = hashlib.sha1(encode_key(value)).digest()
+        h = int.from_bytes(digest[:8], 'big')
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLog with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __len__(self):
+        m = len(self.registers)
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / math.fsum(2.0 ** -x for x in self.registers)
+        zeros = self.registers.count(0)
+        if zeros and estimate <= 2.5 * m:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / float(zeros))
+        return int(round(estimate))
+
+    def to_dict(self):
+        return dict(
+            precision=self.precision,
+            registers=base64.b64encode(bytes(self.registers)).decode('ascii'))
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(data['precision'])
+        registers = base64.b64decode(data['registers'])
+        if len(registers) != len(result.registers):
+            raise ValueError("Wrong number of HyperLogLog registers")
+        result.registers[:] = registers
+        return result
+
+
+class CountMinSketch(object):
+    # Counts never go below the true value, they are overestimated by at
+    # most 2 * total / width with a probability of 1 - 0.5 ** depth.
+
+    def __init__(self, width=2048, depth=4):
+        if not 1 <= depth <= 16:
+            raise ValueError("depth must be between 1 and 16")
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.tables = [array.array('Q', [0]) * width for i in range(depth)]
+
+    def indexes(self, key):
+        digest = hashlib.blake2b(encode_key(key), digest_size=4 * self.depth).digest()
+        for i in range(self.depth):
+            yield int.from_bytes(digest[i * 4:i * 4 + 4], 'little') % self.width
+
+    def add(self, key, count=1):
+        for table, index in zip(self.tables, self.indexes(key)):
+            table[index] += count
+        self.total += count
+
+    def __getitem__(self, key):
+        return min(
+            table[index]
+            for table, index in zip(self.tables, self.indexes(key)))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Can't merge CountMinSketch with different dimensions")
+        for table, other_table in zip(self.tables, other.tables):
+            for index, count in enumerate(other_table):
+                if count:
+                    table[index] += count
+        self.total += other.total
+
+    def to_dict(self):
+        return dict(
+            width=self.width,
+            depth=self.depth,
+            total=self.total,
+            tables=[
+                base64.b64encode(x.tobytes()).decode('ascii')
+                for x in self.tables])
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(data['width'], data['depth'])
+        if len(data['tables']) != result.depth:
+            raise ValueError("Wrong number of CountMinSketch tables")
+        result.total = data['total']
+        for table, encoded in zip(result.tables, data['tables']):
+            values = array.array('Q')
+            values.frombytes(base64.b64decode(encoded))
+            if len(values) != result.width:
+                raise ValueError("Wrong CountMinSketch table size")
+            table[:] = values
+        return result
+
+
+class HeavyHitters(object):
+    # keeps the keys with the highest estimated counts of a count-min
+    # sketch as candidates for the top entries
+
+    def __init__(self, size=100, width=2048, depth=4):
+        self.size = size
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+
+    def add(self, key, count=1):
+        self.sketch.add(key, count)
+        candidates = self.candidates
+        if key in candidates or len(candidates) < self.size:
+            candidates[key] = self.sketch[key]
+            return
+        estimate = self.sketch[key]
+        smallest = min(candidates, key=candidates.get)
+        if estimate > candidates[smallest]:
+            del candidates[smallest]
+            candidates[key] = estimate
+
+    def __getitem__(self, key):
+        return self.sketch[key]
+
+    def top(self, count=None):
+        result = sorted(
+            self.candidates.items(), key=lambda x: (-x[1], x[0]))
+        return result[:count]
+
+    def merge(self, other):
+        if other.size != self.size:
+            raise ValueError("Can't merge HeavyHitters with different size")
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates)
+        keys.update(other.candidates)
+        candidates = sorted(
+            ((key, self.sketch[key]) for key in keys),
+            key=lambda x: (-x[1], x[0]))
+        self.candidates = dict(candidates[:self.size])
+
+    def to_dict(self):
+        return dict(
+            size=self.size,
+            sketch=self.sketch.to_dict(),
+            candidates=sorted(self.candidates))
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(data['size'])
+        result.sketch = CountMinSketch.from_dict(data['sketch'])
+        result.candidates = {x: result.sketch[x] for x in data['candidates']}
+        return result
+
+
+class Aggregator(object):
+    # Consumes bounces and keeps exact counts per status class and action,
+    # estimates the number of distinct recipients and domains and tracks
+    # the top domains and reporting MTAs in fixed size sketches.
+    # Aggregators with the same parameters can be merged, so each worker
+    # can use its own and the results combined afterwards.
+
+    def __init__(self, precision=14, width=2048, depth=4, top=100):
+        self.count = 0
+        self.status_classes = collections.Counter()
+        self.actions = collections.Counter()
+        self.recipients = HyperLogLog(precision)
+        self.domains = HyperLogLog(precision)
+        self.top_domains = HeavyHitters(top, width, depth)
+        self.top_reporting_mtas = HeavyHitters(top, width, depth)
+
+    def add(self, bounce):
+        self.count += 1
+        self.status_classes[get_status_class(bounce.status)] += 1
+        self.actions[bounce.action or 'unknown'] += 1
+        address = normalize_address(bounce.recipient)
+        if address is not None:
+            domain = get_domain(address)
+            self.recipients.add(address)
+            self.domains.add(domain)
+            self.top_domains.add(domain)
+        if bounce.reporting_mta:
+            self.top_reporting_mtas.add(bounce.reporting_mta.lower())
+
+    def update(self, bounces):
+        # accepts the result of get_bounces, including None
+        for bounce in bounces or ():
+            self.add(bounce)
+
+    def merge(self, other):
+        self.count += other.count
+        self.status_classes.update(other.status_classes)
+        self.actions.update(other.actions)
+        self.recipients.merge(other.recipients)
+        self.domains.merge(other.domains)
+        self.top_domains.merge(other.top_domains)
+        self.top_reporting_mtas.merge(other.top_reporting_mtas)
+
+    def to_dict(self):
+        return dict(
+            count=self.count,
+            status_classes=dict(self.status_classes),
+            actions=dict(self.actions),
+            recipients=self.recipients.to_dict(),
+            domains=self.domains.to_dict(),
+            top_domains=self.top_domains.to_dict(),
+            top_reporting_mtas=self.top_reporting_mtas.to_dict())
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls()
+        result.count = data['count']
+        result.status_classes.update(data['status_classes'])
+        result.actions.update(data['actions'])
+        result.recipients = HyperLogLog.from_dict(data['recipients'])
+        result.domains = HyperLogLog.from_dict(data['domains'])
+        result.top_domains = HeavyHitters.from_dict(data['top_domains'])
+        result.top_reporting_mtas = HeavyHitters.from_dict(data['top_reporting_mtas'])
+        return result
+
+
+class Windows(object):
+    # one aggregator per time interval, older ones are dropped
+
+    def __init__(self, interval=3600, keep=24, factory=Aggregator):
+        self.interval = interval
+        self.keep = keep
+        self.factory = factory
+        self.windows = collections.OrderedDict()
+
+    def get(self, timestamp):
+        start = int(timestamp // self.interval) * self.interval
+        if start not in self.windows:
+            self.windows[start] = self.factory()
+            for key in sorted(self.windows)[:-self.keep]:
+                del self.windows[key]
+        return self.windows.get(start)
+
+    def update(self, bounces, timestamp):
+        aggregator = self.get(timestamp)
+        if aggregator is not None:
+            aggregator.update(bounces)
+
+    def merged(self, since=None):
+        result = self.factory()
+        for start, aggregator in self.windows.items():
+            if since is None or start + self.interval > since:
+                result.merge(aggregator)
+        return result
@@ -0,0 +1,156 @@
+from .bounced import Bounce
+import array
+
+
+class StringTable(object):
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.strings)
+
+    def add(self, value):
+        if value is None:
+            return -1
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.ids[value] = len(self.strings)
+            self.strings.append(value)
+            return self.ids[value]
+
+    def get(self, id):
+        if id < 0:
+            return
+        return self.strings[id]
+
+
+class StringColumn(object):
+    # utf-8 data with arrow compatible int32 offsets and validity bitmap
+    def __init__(self):
+        self.offsets = array.array('i', [0])
+        self.data = bytearray()
+        self.validity = bytearray()
+        self.length = 0
+
+    def append(self, value):
+        index = self.length
+        if index % 8 == 0:
+            self.validity.append(0)
+        if value is not None:
+            self.data.extend(value.encode('utf-8', 'surrogateescape'))
+            self.validity[index >> 3] |= 1 << (index & 7)
+        self.offsets.append(len(self.data))
+        self.length += 1
+
+    def get(self, index):
+        if not self.validity[index >> 3] & (1 << (index & 7)):
+            return
+        start = self.offsets[index]
+        end = self.offsets[index + 1]
+        return self.data[start:end].decode('utf-8', 'surrogateescape')
+
+
+class BounceBatch(object):
+    # Stores bounces column wise. Appending after exporting to numpy or
+    # arrow raises BufferError as long as the exported arrays are alive,
+    # because they share memory with the batch.
+
+    def __init__(self, bounces=()):
+        self.statuses = StringTable()
+        self.actions = StringTable()
+        self.reporting_mtas = StringTable()
+        self.msgs = StringTable()
+        self.status_ids = array.array('i')
+        self.action_ids = array.array('i')
+        self.reporting_mta_ids = array.array('i')
+        self.msg_ids = array.array('i')
+        self.recipient_names = StringColumn()
+        self.recipient_addrs = StringColumn()
+        self.extend(bounces)
+
+    def __len__(self):
+        return len(self.status_ids)
+
+    def append(self, bounce):
+        if bounce.recipient is None:
+            (name, addr) = (None, None)
+        else:
+            (name, addr) = bounce.recipient
+        self.status_ids.append(self.statuses.add(bounce.status))
+        self.action_ids.append(self.actions.add(bounce.action))
+        self.reporting_mta_ids.append(self.reporting_mtas.add(bounce.reporting_mta))
+        self.msg_ids.append(self.msgs.add(bounce.msg))
+        self.recipient_names.append(name)
+        self.recipient_addrs.append(addr)
+
+    def extend(self, bounces):
+        for bounce in bounces:
+            self.append(bounce)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("BounceBatch index out of range")
+        addr = self.recipient_addrs.get(index)
+        if addr is None:
+            recipient = None
+        else:
+            recipient = (self.recipient_names.get(index), addr)
+        return Bounce(
+            recipient=recipient,
+            status=self.statuses.get(self.status_ids[index]),
+            action=self.actions.get(self.action_ids[index]),
+            msg=self.msgs.get(self.msg_ids[index]),
+            reporting_mta=self.reporting_mtas.get(self.reporting_mta_ids[index]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_numpy(self):
+        import numpy
+        length = len(self)
+
+        def validity(column):
+            bits = numpy.frombuffer(column.validity, dtype=numpy.uint8)
+            return numpy.unpackbits(bits, bitorder='little')[:length].astype(bool)
+
+        return dict(
+            status=numpy.frombuffer(self.status_ids, dtype=numpy.int32),
+            action=numpy.frombuffer(self.action_ids, dtype=numpy.int32),
+            reporting_mta=numpy.frombuffer(self.reporting_mta_ids, dtype=numpy.int32),
+            msg=numpy.frombuffer(self.msg_ids, dtype=numpy.int32),
+            recipient_valid=validity(self.recipient_addrs),
+            recipient_name_offsets=numpy.frombuffer(self.recipient_names.offsets, dtype=numpy.int32),
+            recipient_name_data=numpy.frombuffer(self.recipient_names.data, dtype=numpy.uint8),
+            recipient_addr_offsets=numpy.frombuffer(self.recipient_addrs.offsets, dtype=numpy.int32),
+            recipient_addr_data=numpy.frombuffer(self.recipient_addrs.data, dtype=numpy.uint8))
+
+    def to_arrow(self):
+        import numpy
+        import pyarrow
+        length = len(self)
+
+        def dictionary(ids, table, type):
+            indices = numpy.frombuffer(ids, dtype=type)
+            indices = pyarrow.array(indices, mask=indices < 0)
+            return pyarrow.DictionaryArray.from_arrays(
+                indices, pyarrow.array(table.strings, type=pyarrow.string()))
+
+        def strings(column):
+            return pyarrow.Array.from_buffers(pyarrow.string(), length, [
+                pyarrow.py_buffer(column.validity),
+                pyarrow.py_buffer(column.offsets),
+                pyarrow.py_buffer(column.data)])
+
+        return pyarrow.RecordBatch.from_arrays([
+            strings(self.recipient_names),
+            strings(self.recipient_addrs),
+            dictionary(self.status_ids, self.statuses, numpy.int32),
+            dictionary(self.action_ids, self.actions, numpy.int32),
+            dictionary(self.msg_ids, self.msgs, numpy.int32),
+            dictionary(self.reporting_mta_ids, self.reporting_mtas, numpy.int32)], names=[
+                'recipient_name', 'recipient_addr', 'status', 'action', 'msg', 'reporting_mta'])
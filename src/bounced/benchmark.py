@@ -0,0 +1,238 @@
+from .bounced import get_bounces
+from .bounced import get_bounces_from_bytes
+from .bounced import get_delivery_status
+from .bounced import message_from_bytes
+from pkg_resources import resource_listdir
+from pkg_resources import resource_string
+import argparse
+import attr
+import random
+import time
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2, the peak memory can't be measured
+    tracemalloc = None
+
+
+CORPORA = (
+    'tests/bounces',
+    'tests/flufl_bounce',
+    'tests/bounce_email/bounces',
+    'tests/bounce_email/non_bounces')
+
+
+def iter_corpus(path):
+    for fn in sorted(resource_listdir('bounced', path)):
+        if fn.endswith('.eml'):
+            yield (fn, resource_string('bounced', path + '/' + fn))
+
+
+def bench_get_delivery_status(data):
+    return get_delivery_status(message_from_bytes(data))
+
+
+def bench_get_bounces(data):
+    return get_bounces(message_from_bytes(data))
+
+
+FUNCTIONS = dict(
+    get_delivery_status=bench_get_delivery_status,
+    get_bounces=bench_get_bounces,
+    get_bounces_from_bytes=get_bounces_from_bytes)
+
+
+def get_outcome(result):
+    if isinstance(result, ValueError):
+        return 'ValueError'
+    if result is None:
+        return 'None'
+    if isinstance(result, set) and not result:
+        return 'empty'
+    return 'DSN'
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+@attr.s
+class Result(object):
+    name = attr.ib()
+    latencies = attr.ib(default=attr.Factory(list))
+    peak_memory = attr.ib(default=None)
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def messages_per_second(self):
+        total = sum(self.latencies)
+        if not total:
+            return 0.0
+        return self.count / total
+
+    @property
+    def p50(self):
+        return percentile(self.latencies, 50)
+
+    @property
+    def p99(self):
+        return percentile(self.latencies, 99)
+
+
+def run(func, messages, repeat=1, memory=False):
+    # Returns results for all messages and per corpus and outcome. The
+    # messages can be a generator, each one is processed ``repeat`` times
+    # in a row and only the latencies are kept.
+    results = {}
+
+    def get(name):
+        if name not in results:
+            results[name] = Result(name)
+        return results[name]
+
+    timer = time.perf_counter
+    for corpus, data in messages:
+        latencies = []
+        for i in range(repeat):
+            start = timer()
+            try:
+                result = func(data)
+            except ValueError as e:
+                result = e
+            latencies.append(timer() - start)
+        names = ('all', 'corpus: %s' % corpus, 'outcome: %s' % get_outcome(result))
+        for name in names:
+            get(name).latencies.extend(latencies)
+        if memory:
+            # after the timed calls, as tracing allocations distorts them
+            tracemalloc.start()
+            try:
+                func(data)
+            except ValueError:
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            for name in names:
+                result = get(name)
+                result.peak_memory = max(result.peak_memory or 0, peak)
+    return sorted(results.values(), key=lambda x: (x.name != 'all', x.name))
+
+
+def make_dsn(recipients, original_size=0, depth=0, index=0):
+    boundary = 'report-%d' % index
+    blocks = ['Reporting-MTA: dns; mx%d.example.com\nArrival-Date: Mon, 1 Jan 2018 00:00:00 +0000' % (index % 50)]
+    for i in range(recipients):
+        blocks.append(
+            'Final-Recipient: rfc822; user%d.%d@example%d.com\n'
+            'Action: failed\n'
+            'Status: 5.1.1\n'
+            'Diagnostic-Code: smtp; 550-5.1.1 user unknown\n'
+            '    550 5.1.1 please check the address' % (index, i, i % 10))
+    body = 'x' * 76 + '\n'
+    original = (
+        'Message-ID: <%d@example.com>\n'
+        'Subject: original\n\n' % index) + body * (original_size // len(body))
+    msg = (
+        'From: MAILER-DAEMON@example.com\n'
+        'Subject: Undelivered Mail Returned to Sender\n'
+        'MIME-Version: 1.0\n'
+        'Content-Type: multipart/report; report-type=delivery-status;\n'
+        '    boundary="%(boundary)s"\n\n'
+        '--%(boundary)s\n'
+        'Content-Type: text/plain\n\n'
+        'Delivery failed.\n\n'
+        '--%(boundary)s\n'
+        'Content-Type: message/delivery-status\n\n'
+        '%(fields)s\n\n'
+        '--%(boundary)s\n'
+        'Content-Type: message/rfc822\n\n'
+        '%(original)s\n'
+        '--%(boundary)s--\n') % dict(
+            boundary=boundary, fields='\n\n'.join(blocks), original=original)
+    for level in range(depth):
+        boundary = 'nested-%d-%d' % (index, level)
+        msg = (
+            'Subject: Fwd: bounce\n'
+            'MIME-Version: 1.0\n'
+            'Content-Type: multipart/mixed; boundary="%(boundary)s"\n\n'
+            '--%(boundary)s\n'
+            'Content-Type: text/plain\n\n'
+            'Forwarded bounce.\n\n'
+            '--%(boundary)s\n'
+            'Content-Type: message/rfc822\n\n'
+            '%(msg)s\n'
+            '--%(boundary)s--\n') % dict(boundary=boundary, msg=msg)
+    return msg.encode('ascii')
+
+
+def iter_messages(synthetic=0, seed=0):
+    # the shipped samples followed by the generated messages
+    for path in CORPORA:
+        for fn, data in iter_corpus(path):
+            yield (path, data)
+    if synthetic:
+        for item in generate_corpus(synthetic, seed=seed):
+            yield item
+
+
+def generate_corpus(count, seed=0, samples=None, max_recipients=20, max_size=256 * 1024, max_depth=3):
+    # yields (corpus, data) tuples mixing the shipped samples with
+    # synthetic delivery status reports of varied size and structure
+    rnd = random.Random(seed)
+    if samples is None:
+        samples = list(iter_messages())
+    for index in range(count):
+        if samples and rnd.random() < 0.5:
+            yield rnd.choice(samples)
+            continue
+        yield ('synthetic', make_dsn(
+            recipients=rnd.randint(1, max_recipients),
+            original_size=int(rnd.paretovariate(1.5) * 1024) % max_size,
+            depth=rnd.randint(0, max_depth) if rnd.random() < 0.2 else 0,
+            index=index))
+
+
+def format_result(result):
+    line = '%-45s %8d %10.0f/s  p50 %8.1fus  p99 %8.1fus' % (
+        result.name, result.count, result.messages_per_second,
+        result.p50 * 1e6, result.p99 * 1e6)
+    if result.peak_memory is not None:
+        line += '  peak %8.1fKiB' % (result.peak_memory / 1024.0)
+    return line
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark bounced over the shipped bounce corpora.")
+    parser.add_argument(
+        '-f', '--function', action='append', choices=sorted(FUNCTIONS),
+        help="Function to benchmark, can be given multiple times.")
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help="How often to process each message.")
+    parser.add_argument(
+        '-s', '--synthetic', type=int, default=0, metavar='COUNT',
+        help="Add COUNT generated messages to the shipped samples.")
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help="Random seed for the generated messages.")
+    parser.add_argument(
+        '-m', '--memory', action='store_true',
+        help="Measure peak memory per message with tracemalloc.")
+    args = parser.parse_args(args)
+    for name in args.function or sorted(FUNCTIONS):
+        print(name)
+        messages = iter_messages(args.synthetic, seed=args.seed)
+        for result in run(FUNCTIONS[name], messages, repeat=args.repeat, memory=args.memory):
+            print('  ' + format_result(result))
+
+
+if __name__ == '__main__':
+    main()
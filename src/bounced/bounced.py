@@ -1,6 +1,89 @@
+from .address import normalize_address
+from .address import normalize_recipient
+from .cache import memoize
+from .cache import missing
 import attr
+import codecs
 import email
+import email.message
+import email.parser
+import email.utils
 import re
+try:
+    from email import message_from_bytes
+except ImportError:  # pragma: no cover
+    from email import message_from_string as message_from_bytes
+try:
+    codecs.lookup_error('surrogateescape')
+except LookupError:  # pragma: no cover
+    # the email package of Python 2 works on byte strings, which are
+    # also used instead of memoryview slices
+    def decode_ascii(data):
+        return bytes(data)
+
+    def encode_ascii(text):
+        return text
+
+    def slice_data(data, start, end):
+        return bytes(data[start:end])
+else:
+    def decode_ascii(data):
+        return bytes(data).decode('ascii', 'surrogateescape')
+
+    def encode_ascii(text):
+        return text.encode('ascii', 'surrogateescape')
+
+    def slice_data(data, start, end):
+        return memoryview(data)[start:end]
+
+
+# same rules the email feedparser uses to decide where headers end
+_eol_re = re.compile(br'\r\n|\r|\n')
+_header_line_re = re.compile(br'From |([\041-\071\073-\176]*):|[ \t]')
+_delivery_status_re = re.compile(br'message/delivery-status', re.IGNORECASE)
+_diagnostic_code_re = re.compile(r'(\d+)[\s\-]*(.*)$', re.DOTALL)
+_non_ascii_re = re.compile(br'[\x80-\xff]')
+_line_re = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+_field_line_re = re.compile(r'From |[\041-\071\073-\176]*:|[ \t]')
+
+
+# maximum number of raw DSN field values remembered per field parser
+FIELD_CACHE_SIZE = 4096
+
+
+# set by bounced.instrumentation.enable, None when disabled
+instrumentation = None
+
+
+class LimitExceeded(ValueError):
+    def __init__(self, limit, value, maximum):
+        ValueError.__init__(
+            self, "Limit exceeded for %s: %s > %s" % (limit, value, maximum))
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+
+    def __reduce__(self):
+        # args only holds the message, results of worker processes need
+        # to be unpickled with the original arguments
+        return (LimitExceeded, (self.limit, self.value, self.maximum))
+
+
+@attr.s(frozen=True)
+class Limits(object):
+    # None disables the respective limit
+    max_size = attr.ib(default=None)
+    max_depth = attr.ib(default=None)
+    # number of per-message and per-recipient field groups in a DSN
+    max_fields = attr.ib(default=None)
+    max_diagnostic_length = attr.ib(default=None)
+
+    def check(self, limit, value):
+        maximum = getattr(self, limit)
+        if maximum is not None and value > maximum:
+            if instrumentation is not None:
+                instrumentation.error('limit-%s' % limit)
+            raise LimitExceeded(limit, value, maximum)
 
 
 @attr.s(frozen=True)
@@ -12,10 +95,63 @@ class Bounce(object):
     reporting_mta = attr.ib(default=None)
 
 
+class Fields(dict):
+    # the subset of the email.message.Message mapping API used on the
+    # per-message and per-recipient field groups of a DSN
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+    def add(self, name, value):
+        dict.setdefault(self, name.lower(), value)
+
+
+@attr.s(frozen=True)
+class RawOriginal(object):
+    data = attr.ib(repr=False)
+
+    def parse(self):
+        if isinstance(self.data, str):
+            return email.message_from_string(self.data)
+        return message_from_bytes(bytes(self.data))
+
+    def parse_headers(self):
+        if isinstance(self.data, str):
+            return email.parser.HeaderParser().parsestr(self.data)
+        (headers, body_start) = parse_headers(self.data)
+        return email.parser.BytesHeaderParser().parsebytes(
+            bytes(self.data[:body_start]))
+
+
 @attr.s
 class DSN(object):
     fields = attr.ib()
-    original = attr.ib(default=None)
+    _original = attr.ib(default=None)
+    original_source = attr.ib(default=None, repr=False)
+
+    @property
+    def original(self):
+        # the returned message is only parsed on first access
+        if self._original is None and self.original_source is not None:
+            self._original = self.original_source.parse()
+        return self._original
+
+    @original.setter
+    def original(self, value):
+        self._original = value
+        self.original_source = None
+
+    @property
+    def original_headers(self):
+        if self._original is not None or self.original_source is None:
+            return self._original
+        return self.original_source.parse_headers()
 
 
 def get_message_rfc822(part):
@@ -25,7 +161,9 @@ def get_message_rfc822(part):
     raise ValueError("message/rfc822 with multiple parts")
 
 
-def get_delivery_status(msg):
+def get_delivery_status(msg, limits=None, depth=0):
+    if limits is not None:
+        limits.check('max_depth', depth)
     if not msg.is_multipart():
         return
     parts = msg.get_payload()
@@ -39,7 +177,7 @@ def get_delivery_status(msg):
         for part in msg.get_payload():
             if part.get_content_type() == 'message/rfc822':
                 part = get_message_rfc822(part)
-            dsn = get_delivery_status(part)
+            dsn = get_delivery_status(part, limits, depth + 1)
             if dsn is not None:
                 return dsn
         return
@@ -51,14 +189,223 @@ def get_delivery_status(msg):
     dsn = DSN(fields)
     if len(parts) == 3:
         if parts[2].get_content_type() == 'text/rfc822-headers':
-            dsn.original = email.message_from_string(parts[2].get_payload())
+            dsn.original_source = RawOriginal(parts[2].get_payload())
         elif parts[2].get_content_type() == 'message/rfc822':
             dsn.original = get_message_rfc822(parts[2])
     return dsn
 
 
-def get_recipient(field, name):
-    recipient = field[name]
+def header_source_parse(lines):
+    # same as email.policy.compat32.header_source_parse
+    (name, value) = lines[0].split(':', 1)
+    value = value.lstrip(' \t') + ''.join(lines[1:])
+    return (name, value.rstrip('\r\n'))
+
+
+def parse_headers(data, pos=0, end=None, names=(b'content-type',)):
+    # finds the start of the body with the same rules the email
+    # feedparser uses, but only the given headers are parsed
+    if end is None:
+        end = len(data)
+    body_start = end
+    found = []
+    lines = None
+    while pos < end:
+        m = _eol_re.search(data, pos, end)
+        if m is None:
+            (line_end, next_pos) = (end, end)
+        else:
+            (line_end, next_pos) = m.span()
+        if line_end == pos:
+            body_start = next_pos
+            break
+        m = _header_line_re.match(data, pos, line_end)
+        if m is None:
+            body_start = pos
+            break
+        name = m.group(1)
+        if name is not None:
+            name = name.lower()
+            if name in names:
+                lines = [bytes(data[pos:next_pos])]
+                found.append(lines)
+            else:
+                lines = None
+        elif data[pos:pos + 1] in (b' ', b'\t'):
+            if lines is not None:
+                lines.append(bytes(data[pos:next_pos]))
+        else:
+            lines = None
+        pos = next_pos
+    headers = email.message.Message()
+    for lines in found:
+        (name, value) = header_source_parse([decode_ascii(x) for x in lines])
+        # stored unchanged with the default compat32 policy, like set_raw
+        headers[name] = value
+    return (headers, body_start)
+
+
+def parse_delivery_status(data):
+    # split into blocks of header fields separated by blank lines, using
+    # the same rules as the email feedparser
+    text = decode_ascii(data)
+    result = []
+    fields = Fields()
+    lines = []
+    in_body = False
+
+    def add_field():
+        if lines:
+            fields.add(*header_source_parse(lines))
+            del lines[:]
+
+    for line in _line_re.findall(text):
+        if not line.strip('\r\n'):
+            add_field()
+            result.append(fields)
+            fields = Fields()
+            in_body = False
+            continue
+        if in_body:
+            continue
+        if not _field_line_re.match(line):
+            add_field()
+            in_body = True
+            continue
+        if line[0] in ' \t':
+            if lines:
+                lines.append(line)
+            continue
+        add_field()
+        if line.startswith('From ') or line.startswith(':'):
+            continue
+        lines.append(line)
+    add_field()
+    result.append(fields)
+    return [x for x in result if len(x)]
+
+
+def split_multipart(data, boundary, pos=0, end=None):
+    if end is None:
+        end = len(data)
+    delimiter = re.compile(
+        br'(?<![^\r\n])--' + re.escape(boundary) + br'(--)?[ \t]*(?:\r\n|\r|\n|\Z)')
+    parts = []
+    start = None
+    for m in delimiter.finditer(data, pos, end):
+        if start is not None:
+            # the line separator before a delimiter belongs to it
+            part_end = m.start()
+            if data[part_end - 2:part_end] == b'\r\n':
+                part_end -= 2
+            elif data[part_end - 1:part_end] in (b'\r', b'\n'):
+                part_end -= 1
+            parts.append((start, max(start, part_end)))
+        if m.group(1):
+            return parts
+        start = m.end()
+    if start is not None:
+        parts.append((start, end))
+    return parts
+
+
+def locate_delivery_status(data):
+    # returns the DSN for the common case of a delivery status directly
+    # in the top level multipart, None if there can't be one and
+    # ``missing`` if the full message has to be parsed to find out
+    (headers, body_start) = parse_headers(data)
+    if headers.get_content_maintype() != 'multipart':
+        return
+    if _delivery_status_re.search(data, body_start) is None:
+        return
+    boundary = headers.get_boundary()
+    if boundary is None or headers.get_content_subtype() == 'digest':
+        return missing
+    parts = split_multipart(
+        data, encode_ascii(boundary), body_start)
+    if len(parts) < 2:
+        return
+    if len(parts) > 3:
+        return
+    (start, end) = parts[1]
+    (part_headers, body_start) = parse_headers(data, start, end)
+    if part_headers.get_content_type() != 'message/delivery-status':
+        if headers.get_content_type() == 'multipart/report':
+            return
+        return missing
+    if _non_ascii_re.search(data, body_start, end):
+        # the email package turns those into Header instances
+        return missing
+    dsn = DSN(parse_delivery_status(data[body_start:end]))
+    if len(parts) == 3:
+        (start, end) = parts[2]
+        (part_headers, body_start) = parse_headers(data, start, end)
+        if part_headers.get_content_type() in ('text/rfc822-headers', 'message/rfc822'):
+            dsn.original_source = RawOriginal(slice_data(data, body_start, end))
+    return dsn
+
+
+def check_depth(data, limits):
+    # The email package parses nested parts recursively, so the nesting
+    # depth is checked on the raw bytes before the full message is parsed.
+    # Only parts containing other parts count, the message in a
+    # message/rfc822 part has the depth of the part like in
+    # get_delivery_status.
+    stack = [(0, len(data), 0, 'text/plain', False)]
+    while stack:
+        (pos, end, depth, default_type, in_multipart) = stack.pop()
+        (headers, body_start) = parse_headers(data, pos, end)
+        headers.set_default_type(default_type)
+        if headers.get_content_type() == 'message/rfc822':
+            if not in_multipart:
+                depth += 1
+                limits.check('max_depth', depth)
+            stack.append((body_start, end, depth, 'text/plain', False))
+            continue
+        if headers.get_content_maintype() != 'multipart':
+            continue
+        limits.check('max_depth', depth)
+        boundary = headers.get_boundary()
+        if boundary is None:
+            continue
+        if headers.get_content_subtype() == 'digest':
+            default_type = 'message/rfc822'
+        else:
+            default_type = 'text/plain'
+        parts = split_multipart(
+            data, encode_ascii(boundary), body_start, end)
+        for (start, part_end) in parts:
+            stack.append((start, part_end, depth + 1, default_type, True))
+
+
+def parse_message(data, limits=None):
+    # the full parse for what locate_delivery_status can't handle
+    if limits is not None and limits.max_depth is not None:
+        check_depth(data, limits)
+    return message_from_bytes(bytes(data))
+
+
+def get_delivery_status_from_bytes(data, limits=None):
+    if limits is not None:
+        limits.check('max_size', len(data))
+    if instrumentation is None:
+        dsn = locate_delivery_status(data)
+        if dsn is missing:
+            dsn = get_delivery_status(parse_message(data, limits), limits)
+        return dsn
+    with instrumentation.stage('locate'):
+        dsn = locate_delivery_status(data)
+    if dsn is missing:
+        instrumentation.count('fallback')
+        with instrumentation.stage('parse'):
+            msg = parse_message(data, limits)
+        with instrumentation.stage('locate'):
+            dsn = get_delivery_status(msg, limits)
+    return dsn
+
+
+@memoize(FIELD_CACHE_SIZE)
+def parse_recipient(name, recipient):
     addr_parts = recipient.split(';', 1)
     if len(addr_parts) == 1:
         return email.utils.parseaddr(addr_parts[0])
@@ -84,44 +431,75 @@ def get_recipient(field, name):
     raise ValueError("Invalid '%s' in DSN field: %s" % (name, recipient))
 
 
-def get_action(field):
-    if 'action' not in field:
-        return
-    action = field['action'].lower()
+def get_recipient(field, name):
+    recipient = field[name]
+    if instrumentation is not None:
+        kind = recipient.split(';', 1)
+        instrumentation.recipient_kind(
+            kind[0].strip().lower() if len(kind) == 2 else 'bare')
+    try:
+        return normalize_recipient(parse_recipient(name, recipient))
+    except ValueError:
+        if instrumentation is not None:
+            instrumentation.error(name)
+        raise
+
+
+@memoize(FIELD_CACHE_SIZE)
+def parse_action(action):
+    action = action.lower()
     action = action.split(None, 1)
     return action[0]
 
 
-def get_diagnostic_code(field):
-    if 'diagnostic-code' not in field:
+def get_action(field):
+    if 'action' not in field:
         return
-    dc_parts = field['diagnostic-code'].split(';', 1)
+    return parse_action(field['action'])
+
+
+@memoize(FIELD_CACHE_SIZE)
+def parse_diagnostic_code(diagnostic_code):
+    dc_parts = diagnostic_code.split(';', 1)
     if len(dc_parts) != 2:
-        raise ValueError("Invalid Diagnostic-Code in DSN field: %s" % field['diagnostic-code'])
+        raise ValueError("Invalid Diagnostic-Code in DSN field: %s" % diagnostic_code)
     if dc_parts[0].lower() != 'smtp':
-        raise ValueError("Unknown kind of Diagnostic-Code in DSN field: %s" % field['diagnostic-code'])
+        raise ValueError("Unknown kind of Diagnostic-Code in DSN field: %s" % diagnostic_code)
     lines = list(x.strip() for x in dc_parts[1].splitlines())
-    matcher = re.compile(r'(\d+)[\s\-]*(.*)$', re.DOTALL)
+    matcher = _diagnostic_code_re
     matched = list(matcher.match(x) for x in lines)
     if any(x is None for x in matched):
         if matched[0] is None:
-            raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % field['diagnostic-code'])
+            raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % diagnostic_code)
         if any(x is not None for x in matched[1:]):
-            raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % field['diagnostic-code'])
+            raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % diagnostic_code)
         lines = ['\n'.join(lines)]
         matched = list(matcher.match(x) for x in lines)
         if matched[0] is None:
-            raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % field['diagnostic-code'])
+            raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % diagnostic_code)
     lines = list(x.groups() for x in matched)
     if len(set(x[0] for x in lines)) != 1:
-        raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % field['diagnostic-code'])
+        raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % diagnostic_code)
     code = lines[0][0]
     if len(code) != 3:
-        raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % field['diagnostic-code'])
+        raise ValueError("Malformed Diagnostic-Code in DSN field: %s" % diagnostic_code)
     msg = '\n'.join(x[1] for x in lines)
     return (code, msg)
 
 
+def get_diagnostic_code(field, limits=None):
+    if 'diagnostic-code' not in field:
+        return
+    if limits is not None:
+        limits.check('max_diagnostic_length', len(field['diagnostic-code']))
+    try:
+        return parse_diagnostic_code(field['diagnostic-code'])
+    except ValueError:
+        if instrumentation is not None:
+            instrumentation.error('diagnostic-code')
+        raise
+
+
 def get_final_recipient(field):
     if 'final-recipient' not in field:
         return
@@ -134,42 +512,110 @@ def get_original_recipient(field):
     return get_recipient(field, 'original-recipient')
 
 
-def get_reporting_mta(field):
-    if 'reporting-mta' not in field:
-        return
-    rm_parts = field['reporting-mta'].split(';', 1)
+@memoize(FIELD_CACHE_SIZE)
+def parse_reporting_mta(reporting_mta):
+    rm_parts = reporting_mta.split(';', 1)
     if len(rm_parts) == 1:
         return rm_parts[0].split(None, 1)[0]
     if len(rm_parts) != 2:
-        raise ValueError("Invalid Reporting-MTA in DSN field: %s" % field['reporting-mta'])
+        raise ValueError("Invalid Reporting-MTA in DSN field: %s" % reporting_mta)
     if rm_parts[0].lower() == 'dns':
         return rm_parts[1].split(None, 1)[0]
     elif rm_parts[0].lower() == 'x400':
         return
-    raise ValueError("Unknown kind of Reporting-MTA in DSN field: %s" % field['reporting-mta'])
+    raise ValueError("Unknown kind of Reporting-MTA in DSN field: %s" % reporting_mta)
 
 
-def get_status(field):
-    if 'status' not in field:
+def get_reporting_mta(field):
+    if 'reporting-mta' not in field:
         return
-    status = field['status'].lower()
+    try:
+        return parse_reporting_mta(field['reporting-mta'])
+    except ValueError:
+        if instrumentation is not None:
+            instrumentation.error('reporting-mta')
+        raise
+
+
+@memoize(FIELD_CACHE_SIZE)
+def parse_status(value):
+    status = value.lower()
     status = status.split(None, 1)
     if '.' in status[0]:
         status[0] = status[0].split('.')
         if len(status[0]) != 3:
-            raise ValueError("Malformed Status in DSN field: %s" % field['status'])
+            raise ValueError("Malformed Status in DSN field: %s" % value)
         status[0] = ''.join(status[0])
     if len(status) == 1:
         status.append('')
     if len(status) != 2:
-        raise ValueError("Malformed Status in DSN field: %s" % field['status'])
+        raise ValueError("Malformed Status in DSN field: %s" % value)
     return tuple(status)
 
 
-def get_bounces(msg):
-    dsn = get_delivery_status(msg)
+def get_status(field):
+    if 'status' not in field:
+        return
+    try:
+        return parse_status(field['status'])
+    except ValueError:
+        if instrumentation is not None:
+            instrumentation.error('status')
+        raise
+
+
+field_parsers = (
+    normalize_address,
+    parse_action,
+    parse_diagnostic_code,
+    parse_recipient,
+    parse_reporting_mta,
+    parse_status)
+
+
+def field_cache_info():
+    return {x.__name__: x.cache.info() for x in field_parsers}
+
+
+def clear_field_caches():
+    for parser in field_parsers:
+        parser.cache.clear()
+
+
+def get_bounces(msg, limits=None):
+    if instrumentation is None:
+        return get_bounces_from_dsn(get_delivery_status(msg, limits), limits)
+    with instrumentation.stage('locate'):
+        dsn = get_delivery_status(msg, limits)
+    return get_bounces_from_dsn(dsn, limits)
+
+
+def get_bounces_from_dsn(dsn, limits=None):
+    if instrumentation is None:
+        return collect_bounces(dsn, limits)
+    try:
+        with instrumentation.stage('fields'):
+            bounces = collect_bounces(dsn, limits)
+    except LimitExceeded:
+        instrumentation.outcome('limit')
+        raise
+    except ValueError:
+        instrumentation.outcome('error')
+        raise
+    if bounces is None:
+        instrumentation.outcome('none')
+    elif bounces:
+        instrumentation.outcome('bounces')
+    else:
+        instrumentation.outcome('empty')
+    return bounces
+
+
+def collect_bounces(dsn, limits=None):
     if dsn is None:
         return
+    if limits is not None:
+        limits.check('max_fields', len(dsn.fields))
     bounces = set()
     reporting_mta = None
     for field in dsn.fields:
@@ -177,6 +623,8 @@ def get_bounces(msg):
         if final_recipient is None:
             if 'reporting-mta' in field:
                 if reporting_mta is not None:
+                    if instrumentation is not None:
+                        instrumentation.error('multiple-reporting-mta')
                     raise ValueError
                 reporting_mta = get_reporting_mta(field)
                 continue
@@ -190,9 +638,11 @@ def get_bounces(msg):
         if status is not None:
             (status, msg) = status
         try:
-            diagnostic_code = get_diagnostic_code(field)
+            diagnostic_code = get_diagnostic_code(field, limits)
             if diagnostic_code is not None:
                 (status, msg) = diagnostic_code
+        except LimitExceeded:
+            raise
         except ValueError:
             pass
         bounces.add(Bounce(
@@ -202,3 +652,8 @@ def get_bounces(msg):
             msg=msg,
             reporting_mta=reporting_mta))
     return bounces
+
+
+def get_bounces_from_bytes(data, limits=None):
+    return get_bounces_from_dsn(
+        get_delivery_status_from_bytes(data, limits), limits)
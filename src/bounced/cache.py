@@ -0,0 +1,89 @@
+import attr
+import collections
+import functools
+
+
+missing = object()
+
+
+@attr.s(frozen=True)
+class CacheInfo(object):
+    hits = attr.ib()
+    misses = attr.ib()
+    maxsize = attr.ib()
+    currsize = attr.ib()
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.data = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.data.pop(key, default)
+
+    def items(self):
+        return list(self.data.items())
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return CacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            maxsize=self.maxsize,
+            currsize=len(self.data))
+
+
+def memoize(maxsize=1024):
+    def decorator(func):
+        cache = LRUCache(maxsize)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            try:
+                result = cache.get(args, missing)
+            except TypeError:
+                # unhashable arguments, like email.header.Header instances
+                return func(*args)
+            if result is missing:
+                try:
+                    result = (True, func(*args))
+                except ValueError as e:
+                    result = (False, e.args)
+                cache.set(args, result)
+            (ok, value) = result
+            if not ok:
+                raise ValueError(*value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
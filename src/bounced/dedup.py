@@ -0,0 +1,145 @@
+from .bounced import get_bounces_from_dsn
+from .bounced import get_delivery_status
+from .bounced import locate_delivery_status
+from .bounced import parse_headers
+from .bounced import parse_message
+from .cache import LRUCache
+from .cache import missing
+import hashlib
+import json
+import os
+import time
+try:
+    from os import replace
+except ImportError:  # pragma: no cover
+    from os import rename as replace
+
+
+duplicate = object()
+# the located DSN might be ``missing``, so that can't mark it as not given
+not_given = object()
+
+
+ENVELOPE_FIELDS = ('original-envelope-id', 'reporting-mta', 'arrival-date')
+RECIPIENT_FIELDS = ('final-recipient', 'original-recipient', 'action', 'status')
+
+
+def normalize_value(value):
+    if value is None:
+        return
+    return ' '.join(str(value).split()).lower()
+
+
+def hash_key(kind, value):
+    value = repr(value).encode('utf-8', 'surrogateescape')
+    return '%s:%s' % (kind, hashlib.sha1(value).hexdigest())
+
+
+def dsn_fingerprint(dsn):
+    # Identifies repeated notifications for the same original message.
+    # The action and status of each recipient are part of it, so a
+    # final failure after several delays isn't considered a duplicate.
+    envelope = {}
+    recipients = []
+    for field in dsn.fields:
+        if 'final-recipient' in field or 'original-recipient' in field:
+            recipients.append(tuple(
+                normalize_value(field.get(x)) for x in RECIPIENT_FIELDS))
+            continue
+        for name in ENVELOPE_FIELDS:
+            if name in field and name not in envelope:
+                envelope[name] = normalize_value(field[name])
+    # the reporting MTA alone doesn't identify the original message
+    if 'original-envelope-id' not in envelope and 'arrival-date' not in envelope:
+        return
+    return hash_key('dsn', (
+        tuple(envelope.get(x) for x in ENVELOPE_FIELDS),
+        sorted(recipients, key=repr)))
+
+
+def message_fingerprint(data):
+    (headers, body_start) = parse_headers(data, names=(b'message-id',))
+    message_id = normalize_value(headers['message-id'])
+    if message_id:
+        return hash_key('message-id', message_id)
+    return 'content:%s' % hashlib.sha1(data).hexdigest()
+
+
+def fingerprint(data, dsn=not_given):
+    if dsn is not_given:
+        dsn = locate_delivery_status(data)
+    if dsn is not None and dsn is not missing:
+        key = dsn_fingerprint(dsn)
+        if key is not None:
+            return key
+    return message_fingerprint(data)
+
+
+class SeenCache(object):
+    def __init__(self, maxsize=100000, ttl=None, path=None, clock=time.time):
+        self.cache = LRUCache(maxsize)
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __contains__(self, key):
+        timestamp = self.cache.get(key)
+        if timestamp is None:
+            return False
+        if self.ttl is not None and timestamp + self.ttl < self.clock():
+            self.cache.pop(key)
+            return False
+        return True
+
+    def add(self, key):
+        self.cache.set(key, self.clock())
+
+    def expire(self):
+        if self.ttl is None:
+            return
+        limit = self.clock() - self.ttl
+        for key, timestamp in self.cache.items():
+            if timestamp < limit:
+                self.cache.pop(key)
+
+    def load(self):
+        with open(self.path) as f:
+            for key, timestamp in json.load(f):
+                self.cache.set(key, timestamp)
+        self.expire()
+
+    def save(self):
+        self.expire()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.cache.items(), f)
+        replace(tmp, self.path)
+
+
+class Deduplicator(object):
+    def __init__(self, seen=None, limits=None):
+        if seen is None:
+            seen = SeenCache()
+        self.seen = seen
+        self.limits = limits
+
+    def get_bounces(self, data):
+        # returns ``duplicate`` for already seen notifications
+        if self.limits is not None:
+            self.limits.check('max_size', len(data))
+        dsn = locate_delivery_status(data)
+        key = fingerprint(data, dsn)
+        if key in self.seen:
+            return duplicate
+        if dsn is missing:
+            dsn = get_delivery_status(
+                parse_message(data, self.limits), self.limits)
+        bounces = get_bounces_from_dsn(dsn, self.limits)
+        # only after parsing succeeded, so retries get the same error
+        self.seen.add(key)
+        return bounces
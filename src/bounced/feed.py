@@ -0,0 +1,231 @@
+from .bounced import DSN
+from .bounced import get_bounces_from_dsn
+from .bounced import get_delivery_status
+from .bounced import encode_ascii
+from .bounced import get_delivery_status_from_bytes
+from .bounced import parse_delivery_status
+from .bounced import parse_headers
+from .cache import missing
+import re
+try:
+    from email.feedparser import BytesFeedParser
+except ImportError:  # pragma: no cover
+    from email.feedparser import FeedParser as BytesFeedParser
+
+
+_non_ascii_re = re.compile(br'[\x80-\xff]')
+
+
+def strip_eol(data, end):
+    # the line separator before a delimiter belongs to it
+    if data[end - 2:end] == b'\r\n':
+        return end - 2
+    if data[end - 1:end] in (b'\r', b'\n'):
+        return end - 1
+    return end
+
+
+def ends_with_blank_line(data, end):
+    pos = strip_eol(data, end)
+    return pos < end and (pos == 0 or data[pos - 1:pos] in (b'\r', b'\n'))
+
+
+class BounceFeedParser(object):
+    # Incremental parser which decides as early as possible. Feed chunks
+    # of the raw message until ``done`` is true, the remaining data can be
+    # skipped. ``result`` is then None or the set of bounces, like the
+    # return value of get_bounces. Structures the byte level scan doesn't
+    # handle are passed to email.feedparser.BytesFeedParser and decided
+    # on ``close``.
+    #
+    # The bounces are returned as soon as the delivery status part is
+    # complete, without the usually large returned message. Unlike
+    # get_bounces, a report with more than three parts is then still
+    # accepted. With ``strict`` the parser waits for the end of the third
+    # part to apply that rule as well, without keeping its content.
+
+    def __init__(self, limits=None, strict=False):
+        self.limits = limits
+        self.strict = strict
+        self.buffer = bytearray()
+        self.size = 0
+        # end of the last complete line in the buffer
+        self.complete_end = 0
+        # start of the first line of a header block not scanned yet
+        self.header_pos = 0
+        self.headers = None
+        self.delimiter = None
+        self.delimiters = 0
+        self.scan_pos = None
+        self.part_start = None
+        self.part_headers = None
+        self.pending = None
+        self.parser = None
+        self.buffered = False
+        self.dsn = None
+        self.result = missing
+
+    @property
+    def done(self):
+        return self.result is not missing
+
+    def feed(self, data):
+        if self.done:
+            return
+        self.size += len(data)
+        if self.limits is not None:
+            self.limits.check('max_size', self.size)
+        if self.parser is not None:
+            self.parser.feed(data)
+            return
+        start = len(self.buffer)
+        self.buffer.extend(data)
+        if self.buffered:
+            return
+        self.update_complete_end(start)
+        if self.headers is None:
+            self.parse_headers()
+        if self.delimiter is not None and not self.done:
+            self.scan()
+
+    def update_complete_end(self, start):
+        # A trailing \r might be followed by \n, that line isn't complete
+        # yet. The previous data might have ended with such a \r.
+        data = self.buffer
+        pos = max(start - 1, self.complete_end)
+        end = len(data)
+        if data[end - 1:end] == b'\r':
+            end -= 1
+        end = max(data.rfind(b'\n', pos, end), data.rfind(b'\r', pos, end)) + 1
+        self.complete_end = max(self.complete_end, end)
+
+    def find_body_start(self):
+        # The end of a header block only depends on the current line, so
+        # the scan continues at the first line not seen yet.
+        end = self.complete_end
+        (headers, body_start) = parse_headers(
+            self.buffer, self.header_pos, end, names=())
+        if body_start >= end and not ends_with_blank_line(self.buffer, end):
+            self.header_pos = end
+            return
+        return body_start
+
+    def finish(self, dsn):
+        self.dsn = dsn
+        self.buffer = None
+        self.delimiter = None
+        self.result = get_bounces_from_dsn(dsn, self.limits)
+
+    def fallback(self):
+        self.delimiter = None
+        if self.limits is not None and self.limits.max_depth is not None:
+            # the nesting depth is checked on the raw bytes before the
+            # email package parses the message recursively
+            self.buffered = True
+            return
+        self.parser = BytesFeedParser()
+        self.parser.feed(bytes(self.buffer))
+        self.buffer = None
+
+    def parse_headers(self):
+        body_start = self.find_body_start()
+        if body_start is None:
+            return
+        (headers, body_start) = parse_headers(self.buffer, 0, body_start)
+        self.headers = headers
+        if headers.get_content_maintype() != 'multipart':
+            self.finish(None)
+            return
+        boundary = headers.get_boundary()
+        if boundary is None or headers.get_content_subtype() == 'digest':
+            self.fallback()
+            return
+        # same as in split_multipart, \Z only matches at the end of the
+        # data on close, as the scanned data always ends with a line break
+        self.delimiter = re.compile(
+            br'(?<![^\r\n])--' + re.escape(encode_ascii(boundary)) +
+            br'(--)?[ \t]*(?:\r\n|\r|\n|\Z)')
+        self.scan_pos = body_start
+
+    def check_part(self, part_headers):
+        # returns whether the second part is a delivery status
+        self.part_headers = part_headers
+        if part_headers.get_content_type() == 'message/delivery-status':
+            return True
+        if self.headers.get_content_type() == 'multipart/report':
+            self.finish(None)
+        else:
+            self.fallback()
+        return False
+
+    def scan(self):
+        end = self.complete_end
+        for m in self.delimiter.finditer(self.buffer, self.scan_pos, end):
+            self.delimiters += 1
+            self.scan_pos = m.end()
+            self.delimiter_found(m)
+            if self.done or self.delimiter is None:
+                return
+        self.scan_pos = end
+        if self.delimiters == 2 and self.part_headers is None:
+            # the content type of the second part decides early on,
+            # before waiting for the part to end
+            body_start = self.find_body_start()
+            if body_start is not None:
+                (part_headers, body_start) = parse_headers(
+                    self.buffer, self.part_start, body_start)
+                self.check_part(part_headers)
+        elif self.pending is not None and end > 1:
+            # the content of the part after the delivery status isn't
+            # needed, only the preceding line break for the next delimiter
+            del self.buffer[:end - 1]
+            self.complete_end = self.scan_pos = 1
+
+    def delimiter_found(self, m):
+        closed = m.group(1) is not None
+        if self.delimiters == 1:
+            if closed:
+                self.finish(None)
+            return
+        if self.delimiters == 2:
+            if closed:
+                # less than two parts
+                self.finish(None)
+                return
+            self.part_start = self.header_pos = m.end()
+            return
+        if self.delimiters == 3:
+            end = strip_eol(self.buffer, m.start())
+            (part_headers, body_start) = parse_headers(
+                self.buffer, self.part_start, end)
+            if self.part_headers is None and not self.check_part(part_headers):
+                return
+            if _non_ascii_re.search(self.buffer, body_start, end):
+                # the email package turns those into Header instances
+                self.fallback()
+                return
+            self.pending = DSN(parse_delivery_status(self.buffer[body_start:end]))
+            if closed or not self.strict:
+                self.finish(self.pending)
+            return
+        # like get_delivery_status, more than three parts aren't a
+        # delivery status report in strict mode
+        self.finish(self.pending if closed else None)
+
+    def close(self):
+        if self.done:
+            return self.result
+        if self.parser is not None:
+            dsn = get_delivery_status(self.parser.close(), self.limits)
+        elif self.pending is not None:
+            # the data might end with a delimiter without line break
+            self.complete_end = len(self.buffer)
+            self.scan()
+            if self.done:
+                return self.result
+            # the unterminated last part counts
+            dsn = self.pending
+        else:
+            dsn = get_delivery_status_from_bytes(bytes(self.buffer), self.limits)
+        self.finish(dsn)
+        return self.result
@@ -0,0 +1,85 @@
+from . import bounced
+import collections
+import contextlib
+import time
+
+
+class Stats(object):
+    # Collects per stage timings and counters. Subclass and override
+    # ``timing``, ``count``, ``outcome``, ``error`` or ``recipient_kind``
+    # to forward the data to a metrics system directly.
+    #
+    # Stages are "parse" for parsing the full message with the email
+    # package, "locate" for finding the delivery status and "fields" for
+    # parsing the DSN fields into bounces.
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.timers = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.counters = collections.Counter()
+        self.outcomes = collections.Counter()
+        self.errors = collections.Counter()
+        self.recipient_kinds = collections.Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.timing(name, self.clock() - start)
+
+    def timing(self, name, seconds):
+        self.timers[name] += seconds
+        self.calls[name] += 1
+
+    def count(self, name):
+        self.counters[name] += 1
+
+    def outcome(self, name):
+        self.outcomes[name] += 1
+
+    def error(self, category):
+        self.errors[category] += 1
+
+    def recipient_kind(self, kind):
+        self.recipient_kinds[kind] += 1
+
+    def as_dict(self):
+        result = {}
+        for name, seconds in self.timers.items():
+            result['stage.%s.seconds' % name] = seconds
+            result['stage.%s.calls' % name] = self.calls[name]
+        for prefix, counter in (
+                ('count', self.counters),
+                ('outcome', self.outcomes),
+                ('error', self.errors),
+                ('recipient_kind', self.recipient_kinds)):
+            for name, value in counter.items():
+                result['%s.%s' % (prefix, name)] = value
+        return result
+
+
+def enable(stats=None):
+    if stats is None:
+        stats = Stats()
+    bounced.instrumentation = stats
+    return stats
+
+
+def disable():
+    bounced.instrumentation = None
+
+
+@contextlib.contextmanager
+def instrumented(stats=None):
+    previous = bounced.instrumentation
+    stats = enable(stats)
+    try:
+        yield stats
+    finally:
+        bounced.instrumentation = previous
@@ -0,0 +1,230 @@
+from .bounced import get_bounces_from_bytes
+import asyncio
+import attr
+import socket
+
+
+@attr.s
+class Envelope(object):
+    mail_from = attr.ib(default=None)
+    rcpt_tos = attr.ib(default=attr.Factory(list))
+    data = attr.ib(default=None)
+
+
+def get_address(arg, prefix):
+    if not arg[:len(prefix)].upper() == prefix:
+        return
+    address = arg[len(prefix):].strip()
+    if address.startswith('<'):
+        end = address.find('>')
+        if end == -1:
+            return
+        return address[1:end]
+    return address.split(None, 1)[0] if address else None
+
+
+class BounceSink(object):
+    def __init__(self, callback, executor=None, hostname=None, max_size=None,
+                 limits=None):
+        self.callback = callback
+        self.executor = executor
+        self.hostname = hostname or socket.getfqdn()
+        self.max_size = max_size
+        self.limits = limits
+
+    async def start_server(self, host=None, port=24, **kw):
+        return await asyncio.start_server(
+            self.handle_client, host=host, port=port, **kw)
+
+    async def start_unix_server(self, path, **kw):
+        return await asyncio.start_unix_server(
+            self.handle_client, path=path, **kw)
+
+    async def handle_client(self, reader, writer):
+        session = Session(self, reader, writer)
+        try:
+            await session.run()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def process(self, envelope):
+        loop = asyncio.get_event_loop()
+        try:
+            bounces = await loop.run_in_executor(
+                self.executor, get_bounces_from_bytes, envelope.data,
+                self.limits)
+        except Exception as e:
+            (bounces, error) = (None, e)
+        else:
+            error = None
+        await self.callback(envelope, bounces, error)
+
+
+class Session(object):
+    def __init__(self, sink, reader, writer):
+        self.sink = sink
+        self.reader = reader
+        self.writer = writer
+        self.lmtp = None
+        self.envelope = None
+
+    async def push(self, *lines):
+        for line in lines:
+            self.writer.write(line.encode('ascii') + b'\r\n')
+        await self.writer.drain()
+
+    async def run(self):
+        await self.push('220 %s LMTP bounced ready' % self.sink.hostname)
+        while True:
+            try:
+                line = await self.reader.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                await self.push('500 5.5.2 Line too long')
+                return
+            if not line:
+                return
+            line = line.decode('ascii', 'replace').rstrip('\r\n')
+            (command, _, arg) = line.partition(' ')
+            handler = getattr(self, 'smtp_' + command.upper(), None)
+            if handler is None:
+                await self.push('500 5.5.1 Command unrecognized')
+                continue
+            if await handler(arg.strip()) is False:
+                return
+
+    async def hello(self, arg, lmtp):
+        if not arg:
+            await self.push('501 5.5.4 Syntax: %s hostname' % ('LHLO' if lmtp else 'EHLO'))
+            return
+        self.lmtp = lmtp
+        self.envelope = None
+        lines = [self.sink.hostname, '8BITMIME', 'ENHANCEDSTATUSCODES', 'PIPELINING']
+        if self.sink.max_size:
+            lines.append('SIZE %d' % self.sink.max_size)
+        await self.push(*(
+            '250%s%s' % ('-' if i < len(lines) - 1 else ' ', x)
+            for i, x in enumerate(lines)))
+
+    async def smtp_LHLO(self, arg):
+        await self.hello(arg, True)
+
+    async def smtp_EHLO(self, arg):
+        await self.hello(arg, False)
+
+    async def smtp_HELO(self, arg):
+        if not arg:
+            await self.push('501 5.5.4 Syntax: HELO hostname')
+            return
+        self.lmtp = False
+        self.envelope = None
+        await self.push('250 %s' % self.sink.hostname)
+
+    async def smtp_MAIL(self, arg):
+        if self.lmtp is None:
+            await self.push('503 5.5.1 Send LHLO first')
+            return
+        if self.envelope is not None:
+            await self.push('503 5.5.1 Nested MAIL command')
+            return
+        address = get_address(arg, 'FROM:')
+        if address is None:
+            await self.push('501 5.5.4 Syntax: MAIL FROM:<address>')
+            return
+        self.envelope = Envelope(mail_from=address)
+        await self.push('250 2.1.0 Ok')
+
+    async def smtp_RCPT(self, arg):
+        if self.envelope is None:
+            await self.push('503 5.5.1 Need MAIL command')
+            return
+        address = get_address(arg, 'TO:')
+        if not address:
+            await self.push('501 5.5.4 Syntax: RCPT TO:<address>')
+            return
+        self.envelope.rcpt_tos.append(address)
+        await self.push('250 2.1.5 Ok')
+
+    async def read_line(self):
+        # returns None for lines longer than the limit of the stream
+        # reader, after skipping the rest of the line
+        too_long = False
+        while True:
+            try:
+                line = await self.reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                return None if too_long else e.partial
+            except asyncio.LimitOverrunError as e:
+                too_long = True
+                await self.reader.readexactly(e.consumed)
+                continue
+            return None if too_long else line
+
+    async def read_data(self):
+        # returns the data, None if the connection was closed or the
+        # error reply if the data was dropped
+        lines = []
+        size = 0
+        error = None
+        while True:
+            try:
+                line = await self.read_line()
+            except asyncio.IncompleteReadError:
+                return
+            if line is None:
+                # keep reading until the end of data, but drop the content
+                error = error or '500 5.5.2 Line too long'
+                lines = []
+                continue
+            if not line:
+                return
+            if line.rstrip(b'\r\n') == b'.':
+                break
+            if line.startswith(b'.'):
+                line = line[1:]
+            size += len(line)
+            if self.sink.max_size and size > self.sink.max_size:
+                error = error or '552 5.3.4 Message too big'
+                lines = []
+            if error is None:
+                lines.append(line)
+        if error is not None:
+            return error
+        return b''.join(lines)
+
+    async def smtp_DATA(self, arg):
+        envelope = self.envelope
+        if envelope is None or not envelope.rcpt_tos:
+            await self.push('503 5.5.1 Need RCPT command')
+            return
+        await self.push('354 End data with <CR><LF>.<CR><LF>')
+        data = await self.read_data()
+        self.envelope = None
+        if data is None:
+            return False
+        replies = len(envelope.rcpt_tos) if self.lmtp else 1
+        if isinstance(data, str):
+            await self.push(*[data] * replies)
+            return
+        envelope.data = data
+        try:
+            await self.sink.process(envelope)
+        except Exception:
+            await self.push(*['451 4.3.0 Error processing message'] * replies)
+        else:
+            await self.push(*['250 2.0.0 Ok'] * replies)
+
+    async def smtp_RSET(self, arg):
+        self.envelope = None
+        await self.push('250 2.0.0 Ok')
+
+    async def smtp_NOOP(self, arg):
+        await self.push('250 2.0.0 Ok')
+
+    async def smtp_VRFY(self, arg):
+        await self.push('252 2.5.0 Cannot VRFY user')
+
+    async def smtp_QUIT(self, arg):
+        await self.push('221 2.0.0 Bye')
+        return False
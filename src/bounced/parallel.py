@@ -0,0 +1,81 @@
+from .bounced import get_bounces_from_bytes
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from itertools import islice
+import collections
+import os
+
+
+def read_item(item):
+    if isinstance(item, (bytes, bytearray)):
+        return item
+    with open(item, 'rb') as f:
+        return f.read()
+
+
+def classify_chunk(chunk, limits=None):
+    results = []
+    for index, item in chunk:
+        try:
+            result = get_bounces_from_bytes(read_item(item), limits)
+        except Exception as e:
+            results.append((index, None, e))
+        else:
+            results.append((index, result, None))
+    return results
+
+
+def iter_chunks(items, chunksize):
+    items = enumerate(items)
+    while True:
+        chunk = list(islice(items, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_ordered(executor, chunks, max_pending, limits=None):
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(executor.submit(classify_chunk, chunk, limits))
+        if len(pending) >= max_pending:
+            for result in pending.popleft().result():
+                yield result
+    while pending:
+        for result in pending.popleft().result():
+            yield result
+
+
+def iter_completed(executor, chunks, max_pending, limits=None):
+    pending = set()
+    for chunk in chunks:
+        pending.add(executor.submit(classify_chunk, chunk, limits))
+        while len(pending) >= max_pending:
+            (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for result in future.result():
+                    yield result
+    while pending:
+        (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            for result in future.result():
+                yield result
+
+
+def classify_many(items, workers=None, chunksize=16, ordered=True, limits=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize < 1:
+        raise ValueError("chunksize must be at least 1")
+    chunks = iter_chunks(items, chunksize)
+    # only keep a few chunks per worker in flight, so arbitrarily long
+    # inputs don't get queued up in memory all at once
+    max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            results = iter_ordered(executor, chunks, max_pending, limits)
+        else:
+            results = iter_completed(executor, chunks, max_pending, limits)
+        for result in results:
+            yield result
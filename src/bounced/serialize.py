@@ -0,0 +1,280 @@
+from .bounced import Bounce
+from .bounced import DSN
+from .bounced import Fields
+import array
+import itertools
+import struct
+import sys
+
+
+# The encoding is meant for storing and sending results, possibly to or
+# from untrusted parties. Decoding only creates strings and the result
+# classes, so unlike with pickle no code can be run. The strings like
+# status, action and reporting MTA repeat a lot and are only stored once.
+#
+# Layout: magic, version, kind, string table, counts, references
+#
+# Counts and lengths are unsigned LEB128 varints. The string table is a
+# count, an array with the length of each string and all strings as one
+# utf-8 blob, which is decoded in one go and then sliced. Lone surrogates
+# from the surrogateescape error handler are kept with surrogatepass. All
+# string values are references into the table, 0 being None and n the
+# n-th string. Arrays are little endian integers with the smallest width
+# that fits their values, prefixed with that width.
+MAGIC = b'BNC'
+VERSION = 2
+KIND_NONE = b'N'
+KIND_BOUNCE = b'B'
+KIND_BOUNCES = b'S'
+KIND_DSN = b'D'
+_header = struct.Struct('3sBc')
+_typecodes = {1: 'B', 2: 'H', 4: 'I'}
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    result = 0
+    for shift in range(0, 64, 7):
+        if pos >= len(data):
+            raise DecodeError("Truncated data")
+        value = data[pos]
+        pos += 1
+        result |= (value & 0x7f) << shift
+        if not value & 0x80:
+            return (result, pos)
+    raise DecodeError("Varint too long")
+
+
+def write_array(out, values):
+    maximum = max(values) if values else 0
+    for width in sorted(_typecodes):
+        if maximum < 1 << (8 * width):
+            break
+    out.append(width)
+    values = array.array(_typecodes[width], values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    out.extend(values.tobytes())
+
+
+class Writer(object):
+    def __init__(self, kind):
+        self.kind = kind
+        self.strings = []
+        self.ids = {None: 0}
+        self.counts = bytearray()
+        self.refs = []
+
+    def count(self, value):
+        write_varint(self.counts, value)
+
+    def add(self, values):
+        ids = self.ids
+        strings = self.strings
+        refs = self.refs
+        for value in values:
+            ref = ids.get(value)
+            if ref is None:
+                strings.append(value)
+                ref = ids[value] = len(strings)
+            refs.append(ref)
+
+    def bounces(self, bounces):
+        values = []
+        for bounce in bounces:
+            values.extend(bounce.recipient or (None, None))
+            values.append(bounce.status)
+            values.append(bounce.action)
+            values.append(bounce.msg)
+            values.append(bounce.reporting_mta)
+        self.add(values)
+
+    def getvalue(self):
+        result = bytearray(_header.pack(MAGIC, VERSION, self.kind))
+        write_varint(result, len(self.strings))
+        write_array(result, [len(x) for x in self.strings])
+        blob = ''.join(self.strings).encode('utf-8', 'surrogatepass')
+        write_varint(result, len(blob))
+        result.extend(blob)
+        result.extend(self.counts)
+        write_array(result, self.refs)
+        return bytes(result)
+
+
+class Reader(object):
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.pos = 0
+        self.strings = [None]
+
+    def count(self):
+        # every item takes at least one byte, which limits the count for
+        # corrupt or hostile data before anything is allocated
+        (count, self.pos) = read_varint(self.data, self.pos)
+        if count > len(self.data) - self.pos:
+            raise DecodeError("Count exceeds data")
+        return count
+
+    def array(self, count, end=None):
+        if self.pos >= len(self.data):
+            raise DecodeError("Truncated data")
+        width = self.data[self.pos]
+        if width not in _typecodes:
+            raise DecodeError("Invalid array width %d" % width)
+        self.pos += 1
+        if end is None:
+            end = self.pos + count * width
+            if end > len(self.data):
+                raise DecodeError("Truncated data")
+        elif end - self.pos != count * width:
+            raise DecodeError("Wrong size of array")
+        values = array.array(_typecodes[width])
+        values.frombytes(self.data[self.pos:end])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        self.pos = end
+        return values
+
+    def string_table(self):
+        count = self.count()
+        lengths = self.array(count)
+        (size, pos) = read_varint(self.data, self.pos)
+        self.pos = pos + size
+        if self.pos > len(self.data):
+            raise DecodeError("Truncated data")
+        try:
+            text = self.data[pos:self.pos].decode('utf-8', 'surrogatepass')
+        except UnicodeDecodeError:
+            raise DecodeError("Invalid string data")
+        if sum(lengths) != len(text):
+            raise DecodeError("Wrong size of string data")
+        ends = list(itertools.accumulate(lengths))
+        self.strings.extend(
+            map(text.__getitem__, map(slice, [0] + ends, ends)))
+
+    def refs(self, count):
+        # all remaining data, returns the strings instead of references
+        refs = self.array(count, len(self.data))
+        if refs and max(refs) >= len(self.strings):
+            raise DecodeError("Invalid string reference %d" % max(refs))
+        return list(map(self.strings.__getitem__, refs))
+
+
+def iter_bounces(values):
+    names = values[0::6]
+    addrs = values[1::6]
+    for (name, addr) in zip(names, addrs):
+        if (name is None) != (addr is None):
+            raise DecodeError("Invalid recipient")
+    recipients = [
+        None if addr is None else (name, addr)
+        for (name, addr) in zip(names, addrs)]
+    return map(
+        Bounce, recipients, values[2::6], values[3::6], values[4::6],
+        values[5::6])
+
+
+def encode(obj):
+    # Accepts a Bounce, a set of them, a DSN or None. A DSN only keeps
+    # the parsed fields, the original message isn't included.
+    if obj is None:
+        return Writer(KIND_NONE).getvalue()
+    if isinstance(obj, Bounce):
+        writer = Writer(KIND_BOUNCE)
+        writer.bounces((obj,))
+        return writer.getvalue()
+    if isinstance(obj, (set, frozenset)):
+        writer = Writer(KIND_BOUNCES)
+        writer.count(len(obj))
+        writer.bounces(obj)
+        return writer.getvalue()
+    if isinstance(obj, DSN):
+        writer = Writer(KIND_DSN)
+        writer.count(len(obj.fields))
+        values = []
+        for field in obj.fields:
+            items = list(field.items())
+            writer.count(len(items))
+            for name, value in items:
+                values.append(name.lower())
+                values.append(str(value))
+        writer.add(values)
+        return writer.getvalue()
+    raise TypeError("Can't encode %r" % type(obj))
+
+
+def decode(data):
+    reader = Reader(data)
+    try:
+        (magic, version, kind) = _header.unpack_from(reader.data)
+    except struct.error:
+        raise DecodeError("Truncated data")
+    if magic != MAGIC:
+        raise DecodeError("Not encoded bounce data")
+    if version != VERSION:
+        raise DecodeError("Unsupported version %d" % version)
+    reader.pos = _header.size
+    reader.string_table()
+    if kind == KIND_NONE:
+        reader.refs(0)
+        return
+    if kind == KIND_BOUNCE:
+        (bounce,) = iter_bounces(reader.refs(6))
+        return bounce
+    if kind == KIND_BOUNCES:
+        count = reader.count()
+        return set(iter_bounces(reader.refs(count * 6)))
+    if kind == KIND_DSN:
+        sizes = [reader.count() for i in range(reader.count())]
+        values = iter(reader.refs(sum(sizes) * 2))
+        fields = []
+        for size in sizes:
+            field = Fields()
+            for i in range(size):
+                (name, value) = (next(values), next(values))
+                if name is None or value is None:
+                    raise DecodeError("Missing field name or value")
+                field.add(name, value)
+            fields.append(field)
+        return DSN(fields)
+    raise DecodeError("Unknown kind %r" % kind)
+
+
+def dump(obj, stream):
+    # length prefixed frames, so several results can go into one stream
+    data = encode(obj)
+    header = bytearray()
+    write_varint(header, len(data))
+    stream.write(bytes(header) + data)
+
+
+def iter_load(stream, max_size=64 * 1024 * 1024):
+    while True:
+        length = 0
+        for shift in range(0, 64, 7):
+            byte = stream.read(1)
+            if not byte:
+                if shift:
+                    raise DecodeError("Truncated frame header")
+                return
+            length |= (byte[0] & 0x7f) << shift
+            if not byte[0] & 0x80:
+                break
+        else:
+            raise DecodeError("Varint too long")
+        if length > max_size:
+            raise DecodeError("Frame of %d bytes exceeds maximum size" % length)
+        data = stream.read(length)
+        if len(data) != length:
+            raise DecodeError("Truncated frame")
+        yield decode(data)
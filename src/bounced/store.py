@@ -0,0 +1,190 @@
+from .address import normalize_address as _normalize_address
+from .address import normalize_domain
+import attr
+import sqlite3
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipients (
+    address TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    hard_count INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    last_hard_bounce REAL,
+    last_status TEXT,
+    last_action TEXT,
+    last_reporting_mta TEXT,
+    last_msg TEXT);
+CREATE INDEX IF NOT EXISTS recipients_domain ON recipients (domain);
+"""
+
+
+INSERT = """
+INSERT INTO recipients VALUES (
+    :address, :domain, 1, :hard, :timestamp, :timestamp,
+    CASE WHEN :hard THEN :timestamp END,
+    :status, :action, :reporting_mta, :msg)
+"""
+
+
+# the "last_*" columns are only replaced by newer bounces, so ingesting
+# archives out of order still ends up with the latest state
+UPSERT = INSERT + """ON CONFLICT (address) DO UPDATE SET
+    count = count + 1,
+    hard_count = hard_count + excluded.hard_count,
+    first_seen = min(first_seen, excluded.first_seen),
+    last_seen = max(last_seen, excluded.last_seen),
+    last_hard_bounce = CASE
+        WHEN last_hard_bounce IS NULL THEN excluded.last_hard_bounce
+        WHEN excluded.last_hard_bounce > last_hard_bounce THEN excluded.last_hard_bounce
+        ELSE last_hard_bounce END,
+    last_status = CASE WHEN excluded.last_seen >= last_seen
+        THEN excluded.last_status ELSE last_status END,
+    last_action = CASE WHEN excluded.last_seen >= last_seen
+        THEN excluded.last_action ELSE last_action END,
+    last_reporting_mta = CASE WHEN excluded.last_seen >= last_seen
+        THEN excluded.last_reporting_mta ELSE last_reporting_mta END,
+    last_msg = CASE WHEN excluded.last_seen >= last_seen
+        THEN excluded.last_msg ELSE last_msg END
+"""
+
+
+# same as the upsert for SQLite before 3.24, followed by INSERT if no
+# row was updated
+UPDATE = """
+UPDATE recipients SET
+    count = count + 1,
+    hard_count = hard_count + :hard,
+    first_seen = min(first_seen, :timestamp),
+    last_seen = max(last_seen, :timestamp),
+    last_hard_bounce = CASE
+        WHEN NOT :hard THEN last_hard_bounce
+        WHEN last_hard_bounce IS NULL THEN :timestamp
+        WHEN :timestamp > last_hard_bounce THEN :timestamp
+        ELSE last_hard_bounce END,
+    last_status = CASE WHEN :timestamp >= last_seen
+        THEN :status ELSE last_status END,
+    last_action = CASE WHEN :timestamp >= last_seen
+        THEN :action ELSE last_action END,
+    last_reporting_mta = CASE WHEN :timestamp >= last_seen
+        THEN :reporting_mta ELSE last_reporting_mta END,
+    last_msg = CASE WHEN :timestamp >= last_seen
+        THEN :msg ELSE last_msg END
+WHERE address = :address
+"""
+HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+
+@attr.s(frozen=True)
+class RecipientInfo(object):
+    address = attr.ib()
+    domain = attr.ib()
+    count = attr.ib()
+    hard_count = attr.ib()
+    first_seen = attr.ib()
+    last_seen = attr.ib()
+    last_hard_bounce = attr.ib()
+    last_status = attr.ib()
+    last_action = attr.ib()
+    last_reporting_mta = attr.ib()
+    last_msg = attr.ib()
+
+
+def normalize_address(address):
+    # lookups are case insensitive, also for the local part
+    if address is None:
+        return
+    if isinstance(address, tuple):
+        address = address[1]
+    address = _normalize_address(address).lower()
+    if not address:
+        return
+    return address
+
+
+def get_domain(address):
+    return address.rpartition('@')[2]
+
+
+def is_hard_bounce(bounce):
+    return bounce.action == 'failed' and (bounce.status or '').startswith('5')
+
+
+class BounceStore(object):
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def iter_rows(self, bounces, timestamp):
+        for bounce in bounces:
+            address = normalize_address(bounce.recipient)
+            if address is None:
+                continue
+            yield dict(
+                address=address,
+                domain=get_domain(address),
+                hard=int(is_hard_bounce(bounce)),
+                timestamp=timestamp,
+                status=bounce.status,
+                action=bounce.action,
+                reporting_mta=bounce.reporting_mta,
+                msg=bounce.msg)
+
+    def upsert(self, rows):
+        if HAS_UPSERT:
+            self.connection.executemany(UPSERT, rows)
+            return
+        for row in rows:
+            if not self.connection.execute(UPDATE, row).rowcount:
+                self.connection.execute(INSERT, row)
+
+    def add(self, bounces, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.connection:
+            self.upsert(self.iter_rows(bounces, timestamp))
+
+    def add_many(self, items):
+        # items are (bounces, timestamp) tuples, all added in one transaction
+        with self.connection:
+            for bounces, timestamp in items:
+                if timestamp is None:
+                    timestamp = time.time()
+                self.upsert(self.iter_rows(bounces, timestamp))
+
+    def get(self, address):
+        address = normalize_address(address)
+        if address is None:
+            return
+        row = self.connection.execute(
+            "SELECT * FROM recipients WHERE address = ?", (address,)).fetchone()
+        if row is None:
+            return
+        return RecipientInfo(*row)
+
+    def is_hard_bounced(self, address):
+        info = self.get(address)
+        return info is not None and info.hard_count > 0
+
+    def iter_domain(self, domain):
+        cursor = self.connection.execute(
+            "SELECT * FROM recipients WHERE domain = ? ORDER BY address",
+            (normalize_domain(domain),))
+        for row in cursor:
+            yield RecipientInfo(*row)
+
+    def __len__(self):
+        return self.connection.execute("SELECT count(*) FROM recipients").fetchone()[0]
@@ -0,0 +1,94 @@
+from .bounced import get_bounces_from_bytes
+import mailbox
+import mmap
+import os
+
+
+def is_maildir(path):
+    return all(
+        os.path.isdir(os.path.join(path, x))
+        for x in ('cur', 'new', 'tmp'))
+
+
+def iter_maildir(path):
+    md = mailbox.Maildir(path, factory=None, create=False)
+    for key in md.iterkeys():
+        try:
+            data = md.get_bytes(key)
+        except KeyError:
+            # removed by someone else since the directory was listed
+            continue
+        yield (key, data)
+
+
+def iter_mbox(path, offset=0):
+    # Yields (offset, data) tuples. The data is a memoryview into the
+    # memory mapped file, which is only copied if the message needs to be
+    # fully parsed. The offset is the start of the "From " line and can
+    # be passed in to resume at that message.
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    try:
+        if offset:
+            if mm[offset - 1:offset + 5] != b'\nFrom ':
+                raise ValueError("No message starts at offset %d" % offset)
+            pos = offset
+        elif mm[:5] == b'From ':
+            pos = 0
+        else:
+            # like mailbox.mbox anything before the first "From " is ignored
+            pos = mm.find(b'\nFrom ') + 1
+            if not pos:
+                return
+        while pos < size:
+            start = mm.find(b'\n', pos) + 1 or size
+            end = mm.find(b'\nFrom ', start - 1) + 1 or size
+            stop = end
+            if mm[end - 2:end] == b'\n\n':
+                # the empty line in front of the separator
+                stop = end - 1
+            yield (pos, view[start:stop])
+            pos = end
+    finally:
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            # slices are still in use, the map is closed once they are gone
+            pass
+
+
+def iter_streams(streams):
+    for index, stream in enumerate(streams):
+        if isinstance(stream, (bytes, bytearray, memoryview)):
+            yield (index, stream)
+        else:
+            yield (index, stream.read())
+
+
+def iter_messages(source, offset=0):
+    if hasattr(source, '__fspath__'):
+        source = source.__fspath__()
+    if isinstance(source, str) and not os.path.isdir(source):
+        return iter_mbox(source, offset)
+    if offset:
+        raise ValueError("Resuming at an offset is only supported for mbox files")
+    if isinstance(source, str):
+        if not is_maildir(source):
+            raise ValueError("Not a Maildir: %s" % source)
+        return iter_maildir(source)
+    return iter_streams(source)
+
+
+def iter_bounces(source, offset=0, limits=None):
+    for message_id, data in iter_messages(source, offset):
+        try:
+            result = get_bounces_from_bytes(data, limits)
+        except Exception as e:
+            yield (message_id, None, e)
+        else:
+            yield (message_id, result, None)
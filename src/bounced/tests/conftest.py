@@ -0,0 +1,20 @@
+import sys
+
+
+# only the parsing of single messages supports all Python versions
+collect_ignore = []
+if sys.version_info < (3, 6):
+    # hashlib.blake2b
+    collect_ignore.append('test_aggregate.py')
+if sys.version_info < (3, 5):
+    # async def
+    collect_ignore.append('test_lmtp.py')
+if sys.version_info < (3,):
+    collect_ignore.extend([
+        'test_batch.py',
+        'test_benchmark.py',
+        'test_instrumentation.py',
+        'test_parallel.py',
+        'test_serialize.py',
+        'test_stream.py',
+        'test_watch.py'])
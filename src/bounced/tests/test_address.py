@@ -0,0 +1,44 @@
+import pytest
+
+
+@pytest.mark.parametrize('address, expected', [
+    ('Foo.Bar@Example.COM', 'Foo.Bar@example.com'),
+    (' foo@example.com. ', 'foo@example.com'),
+    ('foo(a)example.com', 'foo@example.com'),
+    (u'foo@b\xfccher.example', 'foo@xn--bcher-kva.example'),
+    (u'foo@B\xdcCHER.example', 'foo@xn--bcher-kva.example'),
+    ('"a@b"@example.com', '"a@b"@example.com'),
+    ('foo', 'foo'),
+    ('', '')])
+def test_normalize_address(address, expected):
+    from bounced.address import normalize_address
+    assert normalize_address(address) == expected
+
+
+def test_normalize_address_interned():
+    from bounced.address import normalize_address
+    from bounced.address import normalize_recipient
+    a = normalize_address(''.join(['foo@', 'Example.com']))
+    normalize_address.cache.clear()
+    b = normalize_address(''.join(['foo@', 'example.COM']))
+    assert a is b
+    assert normalize_recipient(None) is None
+    assert normalize_recipient(('', 'foo@EXAMPLE.com')) == ('', 'foo@example.com')
+
+
+def test_get_recipient_normalized():
+    from bounced import Bounce
+    from bounced.bounced import Fields
+    from bounced.bounced import collect_bounces
+    from bounced.bounced import DSN
+    fields = [Fields(), Fields(), Fields()]
+    fields[0].add('Reporting-MTA', 'dns; mx.example.com')
+    fields[1].add('Final-Recipient', 'rfc822; Foo@EXAMPLE.com')
+    fields[1].add('Action', 'failed')
+    fields[1].add('Status', '5.1.1')
+    fields[2].add('Final-Recipient', 'x400; /RFC-822=Foo(a)Example.com/')
+    fields[2].add('Action', 'failed')
+    fields[2].add('Status', '5.1.1')
+    assert collect_bounces(DSN(fields)) == {Bounce(
+        recipient=('', 'Foo@example.com'), status='511', msg='',
+        reporting_mta='mx.example.com')}
@@ -0,0 +1,108 @@
+import json
+import pytest
+
+
+def make_bounce(recipient, status='550', action='failed', reporting_mta='mx.example.com'):
+    from bounced import Bounce
+    return Bounce(
+        recipient=('', recipient), status=status, action=action,
+        reporting_mta=reporting_mta)
+
+
+@pytest.mark.parametrize('count', [0, 10, 1000, 20000])
+def test_hyperloglog(count):
+    from bounced.aggregate import HyperLogLog
+    hll = HyperLogLog()
+    for i in range(count):
+        hll.add('user%d@example.com' % i)
+        hll.add('user%d@example.com' % i)
+    assert abs(len(hll) - count) <= count * 0.03
+
+
+def test_hyperloglog_merge():
+    from bounced.aggregate import HyperLogLog
+    (a, b) = (HyperLogLog(), HyperLogLog())
+    for i in range(3000):
+        a.add('user%d' % i)
+        b.add('user%d' % (i + 2000))
+    a.merge(b)
+    assert abs(len(a) - 5000) <= 150
+    with pytest.raises(ValueError):
+        a.merge(HyperLogLog(10))
+
+
+def test_count_min_sketch():
+    from bounced.aggregate import CountMinSketch
+    (a, b) = (CountMinSketch(width=64), CountMinSketch(width=64))
+    for i in range(1000):
+        a.add('key%d' % (i % 100))
+    b.add('key1', 5)
+    assert all(a['key%d' % i] >= 10 for i in range(100))
+    a.merge(b)
+    assert a['key1'] >= 15
+    assert a.total == 1005
+    with pytest.raises(ValueError):
+        a.merge(CountMinSketch())
+
+
+def test_heavy_hitters():
+    from bounced.aggregate import HeavyHitters
+    (a, b) = (HeavyHitters(size=3), HeavyHitters(size=3))
+    for i in range(100):
+        a.add('a.example.com')
+        a.add('key%d' % i)
+        b.add('b.example.com')
+    for i in range(50):
+        a.add('c.example.com')
+        b.add('c.example.com')
+    assert a.top(2) == [('a.example.com', 100), ('c.example.com', 50)]
+    a.merge(b)
+    assert a.top(3) == [
+        ('a.example.com', 100), ('b.example.com', 100), ('c.example.com', 100)]
+
+
+def test_aggregator():
+    from bounced.aggregate import Aggregator
+    workers = [Aggregator(), Aggregator()]
+    for i in range(1000):
+        workers[i % 2].update([
+            make_bounce('user%d@example%d.com' % (i % 400, i % 4)),
+            make_bounce('User%d@Example.org' % i, status='4.2.2', action='delayed', reporting_mta=None)])
+    workers[0].update(None)
+    workers[0].update(set())
+    result = Aggregator()
+    for worker in workers:
+        result.merge(worker)
+    assert result.count == 2000
+    assert result.status_classes == {'5xx': 1000, '4xx': 1000}
+    assert result.actions == {'failed': 1000, 'delayed': 1000}
+    assert abs(len(result.recipients) - 1400) <= 40
+    assert len(result.domains) == 5
+    assert result.top_domains.top(1) == [('example.org', 1000)]
+    assert result.top_reporting_mtas.top() == [('mx.example.com', 1000)]
+
+
+def test_aggregator_dict():
+    from bounced.aggregate import Aggregator
+    aggregator = Aggregator(precision=10, width=128, depth=2, top=5)
+    for i in range(100):
+        aggregator.add(make_bounce('user%d@example%d.com' % (i, i % 7), status=None))
+    data = json.loads(json.dumps(aggregator.to_dict()))
+    result = Aggregator.from_dict(data)
+    assert result.to_dict() == aggregator.to_dict()
+    assert result.status_classes == {'unknown': 100}
+    assert len(result.recipients) == len(aggregator.recipients)
+    assert result.top_domains.top() == aggregator.top_domains.top()
+
+
+def test_windows():
+    from bounced.aggregate import Windows
+    windows = Windows(interval=60, keep=2)
+    windows.update([make_bounce('foo@example.com')], 10)
+    windows.update([make_bounce('bar@example.com')], 70)
+    windows.update([make_bounce('baz@example.com')], 130)
+    # too old, the window was already dropped
+    windows.update([make_bounce('qux@example.com')], 20)
+    assert sorted(windows.windows) == [60, 120]
+    assert windows.merged().count == 2
+    assert windows.merged(since=125).count == 1
@@ -0,0 +1,54 @@
+from bounced import Bounce
+import pytest
+
+
+bounces = [
+    Bounce(('', 'foo@example.com'), status='550', msg='unknown user', reporting_mta='mx.example.com'),
+    Bounce(('Foo', 'f\xf6o@example.com'), status='550', action='delayed'),
+    Bounce(None, status=None, action=None),
+    Bounce(('', 'bar@example.com'), status='511', reporting_mta='mx.example.com')]
+
+
+def test_batch_roundtrip():
+    from bounced.batch import BounceBatch
+    batch = BounceBatch(bounces)
+    assert len(batch) == 4
+    assert list(batch) == bounces
+    assert batch[-1] == bounces[-1]
+    assert batch.statuses.strings == ['550', '511']
+    assert list(batch.status_ids) == [0, 0, -1, 1]
+    assert list(batch.reporting_mta_ids) == [0, -1, -1, 0]
+    with pytest.raises(IndexError):
+        batch[4]
+
+
+def test_batch_from_corpus():
+    from bounced import get_bounces_from_bytes
+    from bounced.batch import BounceBatch
+    from pkg_resources import resource_stream
+    result = set()
+    for fn in ('dsn_01', 'dsn_05', 'dsn_10'):
+        with resource_stream('bounced', 'tests/flufl_bounce/%s.eml' % fn) as f:
+            result.update(get_bounces_from_bytes(f.read()))
+    assert set(BounceBatch(result)) == result
+
+
+def test_batch_to_numpy():
+    numpy = pytest.importorskip('numpy')
+    from bounced.batch import BounceBatch
+    arrays = BounceBatch(bounces).to_numpy()
+    assert list(arrays['status']) == [0, 0, -1, 1]
+    assert list(arrays['recipient_valid']) == [True, True, False, True]
+    assert numpy.count_nonzero(arrays['status'] == 0) == 2
+    offsets = arrays['recipient_addr_offsets']
+    assert arrays['recipient_addr_data'][offsets[3]:offsets[4]].tobytes() == b'bar@example.com'
+
+
+def test_batch_to_arrow():
+    pytest.importorskip('pyarrow')
+    from bounced.batch import BounceBatch
+    record_batch = BounceBatch(bounces).to_arrow()
+    assert record_batch.num_rows == 4
+    assert record_batch.column(1).to_pylist() == [
+        'foo@example.com', 'f\xf6o@example.com', None, 'bar@example.com']
+    assert record_batch.column(2).to_pylist() == ['550', '550', None, '511']
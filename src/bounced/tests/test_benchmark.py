@@ -0,0 +1,50 @@
+def test_make_dsn():
+    from bounced import get_bounces_from_bytes
+    from bounced.benchmark import make_dsn
+    for depth in range(3):
+        bounces = get_bounces_from_bytes(make_dsn(recipients=3, original_size=1000, depth=depth))
+        assert len(bounces) == 3
+        assert set(x.status for x in bounces) == {'550'}
+        assert set(x.reporting_mta for x in bounces) == {'mx0.example.com'}
+
+
+def test_generate_corpus():
+    from bounced.benchmark import generate_corpus
+    messages = list(generate_corpus(20, samples=[('sample', b'Subject: foo\n\nbar\n')]))
+    assert len(messages) == 20
+    assert set(x[0] for x in messages) == {'sample', 'synthetic'}
+    assert messages == list(generate_corpus(20, samples=[('sample', b'Subject: foo\n\nbar\n')]))
+
+
+def test_run():
+    from bounced import get_bounces_from_bytes
+    from bounced.benchmark import make_dsn
+    from bounced.benchmark import run
+    messages = [
+        ('a', make_dsn(recipients=2)),
+        ('b', b'Subject: foo\n\nbar\n')]
+    calls = []
+
+    def func(data):
+        calls.append(data)
+        return get_bounces_from_bytes(data)
+
+    results = {x.name: x for x in run(func, iter(messages), repeat=2, memory=True)}
+    # the outcome is taken from the timed calls, plus one for the memory
+    assert len(calls) == 6
+    assert sorted(results) == [
+        'all', 'corpus: a', 'corpus: b', 'outcome: DSN', 'outcome: None']
+    assert results['all'].count == 4
+    assert results['outcome: DSN'].count == 2
+    assert results['all'].messages_per_second > 0
+    assert results['all'].p50 <= results['all'].p99
+    assert results['all'].peak_memory > 0
+
+
+def test_iter_messages():
+    from bounced.benchmark import iter_messages
+    messages = iter_messages(synthetic=5)
+    assert not isinstance(messages, list)
+    messages = list(messages)
+    assert sum(1 for x in messages if x[0] == 'synthetic') <= 5
+    assert len(messages) == len(list(iter_messages())) + 5
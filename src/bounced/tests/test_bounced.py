@@ -6,6 +6,7 @@ except ImportError:
 from pkg_resources import resource_listdir
 from pkg_resources import resource_stream
 import os
+import pickle
 import pytest
 
 
@@ -14,7 +15,7 @@ not_defined = object()
 
 @pytest.fixture
 def expected(request):
-    expected = request.node.get_marker('expected').args[0]
+    expected = request.node.get_closest_marker('expected').args[0]
     fn = request.node.funcargs['bounce_fn']
     fn = os.path.basename(fn).replace('.eml', '')
     return expected.get(fn, not_defined)
@@ -42,6 +43,18 @@ def get_email(fn):
         return message_from_binary_file(f)
 
 
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+def get_result(func, arg):
+    try:
+        return func(arg)
+    except ValueError as e:
+        return ValueError(*e.args)
+
+
 @pytest.mark.expected({
     'aol_01': None,
     'bounce-auto-respond': None,
@@ -277,3 +290,191 @@ def test_bounces(bounce_fn, expected):
                 assert bounce.reporting_mta == expected[index].reporting_mta
     else:
         assert result == expected
+
+
+def test_bounces_from_bytes(bounce_fn):
+    from bounced import get_bounces
+    from bounced import get_bounces_from_bytes
+    expected = get_result(get_bounces, get_email(bounce_fn))
+    result = get_result(get_bounces_from_bytes, get_bytes(bounce_fn))
+    if isinstance(expected, ValueError):
+        assert isinstance(result, ValueError)
+        assert result.args == expected.args
+    else:
+        assert result == expected
+
+
+def test_locate_delivery_status_prefilter():
+    from bounced.bounced import DSN
+    from bounced.bounced import locate_delivery_status
+    assert locate_delivery_status(
+        b"Content-Type: text/plain\n\nmessage/delivery-status\n") is None
+    assert locate_delivery_status(
+        b"Content-Type: multipart/mixed; boundary=x\n\n--x\n\nfoo\n--x--\n") is None
+    assert locate_delivery_status(bytearray(
+        b"Content-Type: multipart/report; boundary=x\n\n"
+        b"--x\n\nfoo\n--x\nContent-Type: Message/Delivery-Status\n\n--x--\n")) == DSN([])
+
+
+def test_field_parser_cache():
+    from bounced.bounced import clear_field_caches
+    from bounced.bounced import field_cache_info
+    from bounced.bounced import parse_status
+    clear_field_caches()
+    assert parse_status('5.1.1 (unknown user)') == ('511', '(unknown user)')
+    assert parse_status('5.1.1 (unknown user)') == ('511', '(unknown user)')
+    for i in range(2):
+        with pytest.raises(ValueError) as e:
+            parse_status('5.1 foo')
+        assert e.value.args == ("Malformed Status in DSN field: 5.1 foo",)
+    info = field_cache_info()['parse_status']
+    assert (info.hits, info.misses, info.currsize) == (2, 2, 2)
+
+
+def test_lru_cache():
+    from bounced.cache import LRUCache
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.info().hits == 1
+    assert cache.info().misses == 1
+    assert cache.info().currsize == 2
+
+
+def test_delivery_status_from_bytes(bounce_fn):
+    from bounced.bounced import get_delivery_status
+    from bounced.bounced import get_delivery_status_from_bytes
+    expected = get_result(get_delivery_status, get_email(bounce_fn))
+    result = get_result(get_delivery_status_from_bytes, get_bytes(bounce_fn))
+    if expected is None or isinstance(expected, ValueError):
+        assert type(result) is type(expected)
+        return
+    assert len(result.fields) == len(expected.fields)
+    for field, expected_field in zip(result.fields, expected.fields):
+        names = set(x.lower() for x in field.keys())
+        assert names == set(x.lower() for x in expected_field.keys())
+        for name in names:
+            assert field[name] == expected_field[name]
+
+
+def test_parse_delivery_status():
+    from bounced.bounced import parse_delivery_status
+    fields = parse_delivery_status(
+        b"Reporting-MTA: dns; example.com\r\n"
+        b"\r\n"
+        b"\r\n"
+        b"Final-Recipient: rfc822; foo@example.com\r\n"
+        b"ACTION: failed\r\n"
+        b"Action: delayed\r\n"
+        b"Diagnostic-Code: smtp; 550-5.1.1 foo\r\n"
+        b"    550 5.1.1 bar\r\n"
+        b"this is no header\r\n"
+        b"Status: 5.1.1\r\n"
+        b"\n"
+        b" continuation without header\n"
+        b"Status: 4.0.0")
+    assert len(fields) == 3
+    assert fields[0]['reporting-mta'] == 'dns; example.com'
+    assert fields[1]['Action'] == 'failed'
+    assert fields[1]['diagnostic-code'] == 'smtp; 550-5.1.1 foo\r\n    550 5.1.1 bar'
+    assert 'status' not in fields[1]
+    assert dict(fields[2]) == {'status': '4.0.0'}
+
+
+def test_split_multipart():
+    from bounced.bounced import split_multipart
+    data = b"preamble\n--b\nfoo\n--bar\n--b \r\n\r\nbar\r\n--b--\nepilogue\n--b\n"
+    parts = split_multipart(data, b'b')
+    assert [data[x:y] for x, y in parts] == [b"foo\n--bar", b"\r\nbar"]
+    data = b"--b\nfoo\n--b\nbar\n"
+    parts = split_multipart(data, b'b')
+    assert [data[x:y] for x, y in parts] == [b"foo", b"bar\n"]
+
+
+@pytest.mark.parametrize('fn, message_id', [
+    ('tests/flufl_bounce/dsn_01.eml', '<F1218V8zDv60gxapzha000001ae@hotmail.com>'),
+    ('tests/bounces/longer-status.eml', '<mailman.0.1035637201.19036.mailman-developers@python.org>')])
+def test_lazy_original(fn, message_id):
+    from bounced.bounced import get_delivery_status
+    from bounced.bounced import get_delivery_status_from_bytes
+    expected = get_delivery_status(get_email(fn)).original
+    for dsn in (
+            get_delivery_status(get_email(fn)),
+            get_delivery_status_from_bytes(get_bytes(fn))):
+        assert dsn.original_headers['Message-ID'] == message_id
+        assert dsn.original.items() == expected.items()
+        assert dsn.original is dsn.original
+
+
+def test_limits():
+    from bounced import LimitExceeded
+    from bounced import Limits
+    from bounced import get_bounces_from_bytes
+    from bounced.benchmark import make_dsn
+    data = make_dsn(recipients=3, depth=2)
+    expected = get_bounces_from_bytes(data)
+    assert len(expected) == 3
+    assert get_bounces_from_bytes(data, Limits()) == expected
+    assert get_bounces_from_bytes(data, Limits(
+        max_size=len(data), max_depth=2, max_fields=4,
+        max_diagnostic_length=100)) == expected
+    with pytest.raises(LimitExceeded) as e:
+        get_bounces_from_bytes(data, Limits(max_size=len(data) - 1))
+    assert e.value.limit == 'max_size'
+    with pytest.raises(LimitExceeded) as e:
+        get_bounces_from_bytes(data, Limits(max_depth=1))
+    assert e.value.limit == 'max_depth'
+    with pytest.raises(LimitExceeded) as e:
+        get_bounces_from_bytes(data, Limits(max_fields=3))
+    assert e.value.limit == 'max_fields'
+    # invalid diagnostic codes are ignored, but not when they are too long
+    with pytest.raises(LimitExceeded) as e:
+        get_bounces_from_bytes(data, Limits(max_diagnostic_length=50))
+    assert e.value.limit == 'max_diagnostic_length'
+    assert isinstance(e.value, ValueError)
+    error = pickle.loads(pickle.dumps(e.value))
+    assert (error.limit, error.value, error.maximum) == (
+        'max_diagnostic_length', e.value.value, 50)
+    assert str(error) == str(e.value)
+
+
+def test_limits_deep_nesting():
+    from bounced import LimitExceeded
+    from bounced import Limits
+    from bounced import get_bounces_from_bytes
+    from bounced.benchmark import make_dsn
+    # deep enough to exceed the recursion limit in the email package
+    data = make_dsn(recipients=1, depth=800)
+    with pytest.raises(LimitExceeded) as e:
+        get_bounces_from_bytes(data, Limits(max_depth=5))
+    assert e.value.limit == 'max_depth'
+    assert e.value.value == 6
+    data = (
+        b'Content-Type: multipart/mixed; boundary="b"\n\n'
+        b'--b\nContent-Type: text/plain\n\nfoo\n'
+        b'--b\n' + b'Content-Type: message/rfc822\n\n' * 2000 +
+        b'Content-Type: message/delivery-status\n\n'
+        b'Final-Recipient: rfc822; foo@example.com\n'
+        b'--b--\n')
+    with pytest.raises(LimitExceeded) as e:
+        get_bounces_from_bytes(data, Limits(max_depth=5))
+    assert e.value.limit == 'max_depth'
+    data = make_dsn(recipients=1, depth=3)
+    assert len(get_bounces_from_bytes(data, Limits(max_depth=3))) == 1
+
+
+def test_limits_message():
+    from bounced import LimitExceeded
+    from bounced import Limits
+    from bounced import get_bounces
+    from bounced.benchmark import make_dsn
+    from bounced.bounced import message_from_bytes
+    msg = message_from_bytes(make_dsn(recipients=1, depth=3))
+    assert len(get_bounces(msg, Limits(max_depth=3))) == 1
+    with pytest.raises(LimitExceeded):
+        get_bounces(msg, Limits(max_depth=2))
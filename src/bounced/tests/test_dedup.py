@@ -0,0 +1,141 @@
+from pkg_resources import resource_stream
+import pytest
+
+
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+class Clock(object):
+    now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+def test_deduplicator():
+    from bounced import get_bounces_from_bytes
+    from bounced.dedup import Deduplicator
+    from bounced.dedup import duplicate
+    data = get_bytes('tests/flufl_bounce/dsn_05.eml')
+    resent = data.replace(
+        b'Will-Retry-Until: Mon, 26 Mar 2001 03:42:45 +0100',
+        b'Will-Retry-Until: Mon, 26 Mar 2001 09:42:45 +0100')
+    failed = resent.replace(b'Action: delayed', b'Action: failed')
+    dedup = Deduplicator()
+    assert dedup.get_bounces(data) == get_bounces_from_bytes(data)
+    assert dedup.get_bounces(data) is duplicate
+    assert dedup.get_bounces(resent) is duplicate
+    assert dedup.get_bounces(failed) == get_bounces_from_bytes(failed)
+    assert dedup.get_bounces(failed) is duplicate
+    assert len(dedup.seen) == 2
+
+
+def test_deduplicator_non_dsn():
+    from bounced.dedup import Deduplicator
+    from bounced.dedup import duplicate
+    from bounced.dedup import fingerprint
+    data = get_bytes('tests/flufl_bounce/qmail_01.eml')
+    assert fingerprint(data).startswith('message-id:')
+    assert fingerprint(b'Subject: foo\n\nbar').startswith('content:')
+    dedup = Deduplicator()
+    assert dedup.get_bounces(data) is None
+    assert dedup.get_bounces(data) is duplicate
+
+
+def test_dsn_fingerprint_needs_envelope():
+    from bounced.bounced import locate_delivery_status
+    from bounced.dedup import dsn_fingerprint
+    from bounced.dedup import fingerprint
+    data = get_bytes('tests/flufl_bounce/dsn_05.eml')
+    assert dsn_fingerprint(locate_delivery_status(data)) is not None
+    for name in (b'Original-Envelope-Id', b'Arrival-Date'):
+        data = data.replace(name + b':', b'X-' + name + b':')
+    assert b'Reporting-MTA:' in data
+    assert dsn_fingerprint(locate_delivery_status(data)) is None
+    assert fingerprint(data).startswith('message-id:')
+
+
+def test_deduplicator_locates_once(monkeypatch):
+    from bounced import bounced
+    from bounced.benchmark import make_dsn
+    from bounced.cache import missing
+    from bounced.dedup import Deduplicator
+    from bounced.dedup import duplicate
+    from bounced.dedup import fingerprint
+    calls = []
+    locate_delivery_status = bounced.locate_delivery_status
+    monkeypatch.setattr(
+        'bounced.dedup.locate_delivery_status',
+        lambda data: calls.append(data) or locate_delivery_status(data))
+    # nested, so the full message has to be parsed
+    data = make_dsn(recipients=2, depth=3)
+    assert locate_delivery_status(data) is missing
+    dedup = Deduplicator()
+    assert len(dedup.get_bounces(data)) == 2
+    assert dedup.get_bounces(data) is duplicate
+    assert len(calls) == 2
+    assert fingerprint(data, missing) == fingerprint(data)
+    assert len(calls) == 3
+
+
+def test_deduplicator_error_not_seen():
+    from bounced.dedup import Deduplicator
+    data = get_bytes('tests/flufl_bounce/dsn_05.eml')
+    data = data.replace(b'Reporting-MTA: dns;', b'Reporting-MTA: foo;')
+    dedup = Deduplicator()
+    for i in range(2):
+        with pytest.raises(ValueError):
+            dedup.get_bounces(data)
+    assert len(dedup.seen) == 0
+
+
+def test_deduplicator_limits():
+    from bounced import LimitExceeded
+    from bounced import Limits
+    from bounced.benchmark import make_dsn
+    from bounced.dedup import Deduplicator
+    data = make_dsn(recipients=2, depth=3)
+    dedup = Deduplicator(limits=Limits(max_depth=3, max_fields=3))
+    assert len(dedup.get_bounces(data)) == 2
+    dedup = Deduplicator(limits=Limits(max_depth=2))
+    with pytest.raises(LimitExceeded) as e:
+        dedup.get_bounces(data)
+    assert e.value.limit == 'max_depth'
+    dedup = Deduplicator(limits=Limits(max_fields=2))
+    with pytest.raises(LimitExceeded) as e:
+        dedup.get_bounces(make_dsn(recipients=2))
+    assert e.value.limit == 'max_fields'
+    dedup = Deduplicator(limits=Limits(max_size=10))
+    with pytest.raises(LimitExceeded) as e:
+        dedup.get_bounces(data)
+    assert e.value.limit == 'max_size'
+
+
+def test_seen_cache_ttl_and_persistence(tmpdir):
+    from bounced.dedup import SeenCache
+    path = tmpdir.join('seen.json').strpath
+    clock = Clock()
+    seen = SeenCache(ttl=60, path=path, clock=clock)
+    seen.add('a')
+    clock.now += 50
+    seen.add('b')
+    assert 'a' in seen
+    seen.save()
+    clock.now += 20
+    seen = SeenCache(ttl=60, path=path, clock=clock)
+    assert len(seen) == 1
+    assert 'a' not in seen
+    assert 'b' in seen
+    assert 'c' not in seen
+
+
+def test_seen_cache_maxsize():
+    from bounced.dedup import SeenCache
+    seen = SeenCache(maxsize=2)
+    for key in 'abc':
+        seen.add(key)
+    assert 'a' not in seen
+    assert 'b' in seen
+    assert 'c' in seen
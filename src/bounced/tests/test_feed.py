@@ -0,0 +1,155 @@
+from pkg_resources import resource_listdir
+from pkg_resources import resource_stream
+import pytest
+
+
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+def iter_fns():
+    for path in ('tests/bounces', 'tests/flufl_bounce', 'tests/bounce_email/bounces'):
+        for fn in sorted(resource_listdir('bounced', path)):
+            if fn.endswith('.eml'):
+                yield path + '/' + fn
+
+
+def feed(data, size, limits=None, strict=False):
+    from bounced.feed import BounceFeedParser
+    parser = BounceFeedParser(limits, strict)
+    for pos in range(0, len(data), size):
+        parser.feed(data[pos:pos + size])
+        if parser.done:
+            break
+    return (parser.close(), min(pos + size, len(data)))
+
+
+def get_result(func, *args):
+    try:
+        return func(*args)
+    except ValueError as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('strict', [False, True])
+@pytest.mark.parametrize('size', [1, 13, 1000])
+def test_feed_same_as_get_bounces(size, strict):
+    from bounced import get_bounces_from_bytes
+    for fn in iter_fns():
+        data = get_bytes(fn)
+        expected = get_result(get_bounces_from_bytes, data)
+        result = get_result(feed, data, size, None, strict)
+        if isinstance(result, tuple):
+            result = result[0]
+        assert result == expected, fn
+
+
+def test_feed_not_a_bounce():
+    data = get_bytes('tests/bounce_email/non_bounces/tt_1234210666.eml')
+    (result, fed) = feed(data, 100)
+    assert result is None
+    assert fed < len(data)
+
+
+def test_feed_stops_after_delivery_status():
+    from bounced import get_bounces_from_bytes
+    from bounced.benchmark import make_dsn
+    data = make_dsn(recipients=2, original_size=1024 * 1024)
+    original = data.index(b'Content-Type: message/rfc822')
+    (result, fed) = feed(data, 256)
+    assert result == get_bounces_from_bytes(data)
+    assert len(result) == 2
+    # done before the returned message was fed
+    assert fed < original + 256
+    (result, fed) = feed(data, 64 * 1024)
+    assert len(result) == 2
+    assert fed == 64 * 1024
+
+
+def test_feed_strict_skips_original():
+    from bounced import get_bounces_from_bytes
+    from bounced.benchmark import make_dsn
+    from bounced.feed import BounceFeedParser
+    data = make_dsn(recipients=2, original_size=10000) + b'epilogue\n' * 100
+    parser = BounceFeedParser(strict=True)
+    for pos in range(0, len(data), 10):
+        parser.feed(data[pos:pos + 10])
+        if parser.done:
+            break
+        # the part after the delivery status isn't kept
+        assert len(parser.buffer) < 2000
+    assert parser.result == get_bounces_from_bytes(data)
+    assert len(parser.result) == 2
+    assert pos < len(data) - 800
+
+
+def test_feed_more_than_three_parts():
+    from bounced import get_bounces_from_bytes
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    expected = get_bounces_from_bytes(data)
+    assert expected
+    boundary = b'--Boundary_(ID_+h6gzBCYzjhP3wCVCkWTrg)'
+    (head, sep, tail) = data.rpartition(boundary + b'--')
+    data = head + boundary + b'\nContent-Type: text/plain\n\nfoo\n' + sep + tail
+    assert get_bounces_from_bytes(data) is None
+    for size in (1, 100, len(data)):
+        # decided before the additional part is seen
+        assert feed(data, size)[0] == expected
+        assert feed(data, size, strict=True)[0] is None
+
+
+def test_feed_long_headers():
+    from bounced import get_bounces_from_bytes
+    from bounced.benchmark import make_dsn
+    from bounced.feed import BounceFeedParser
+    data = b'Received: from foo by bar\r\n' * 6000 + make_dsn(recipients=1)
+    parser = BounceFeedParser()
+    parser.feed(data[:100000])
+    # scanning continues after the lines already seen
+    assert 0 < parser.header_pos <= 100000
+    parser.feed(data[100000:])
+    assert parser.close() == get_bounces_from_bytes(data)
+
+
+def test_feed_ignores_data_when_done():
+    from bounced.feed import BounceFeedParser
+    parser = BounceFeedParser()
+    parser.feed(b'Content-Type: text/plain\r\n')
+    assert not parser.done
+    parser.feed(b'\r\nfoo')
+    assert parser.done
+    assert parser.result is None
+    parser.feed(b'bar')
+    assert parser.close() is None
+
+
+def test_feed_fallback():
+    from bounced import get_bounces_from_bytes
+    # the delivery status is nested, so the email package parses it
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    (headers, sep, body) = data.partition(b'\n\n')
+    data = (
+        b'Content-Type: multipart/mixed; boundary="outer"\n\n'
+        b'--outer\nContent-Type: text/plain\n\nfoo\n'
+        b'--outer\n' + headers + b'\n\n' + body + b'\n--outer--\n')
+    assert get_bounces_from_bytes(data)
+    (result, fed) = feed(data, 10)
+    assert result == get_bounces_from_bytes(data)
+    assert fed == len(data)
+
+
+def test_feed_limits():
+    from bounced import LimitExceeded
+    from bounced import Limits
+    from bounced.benchmark import make_dsn
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    with pytest.raises(LimitExceeded):
+        feed(data, 10, Limits(max_size=100))
+    # deep enough to exceed the recursion limit in the email package
+    data = make_dsn(recipients=1, depth=800)
+    with pytest.raises(LimitExceeded) as e:
+        feed(data, 1000, Limits(max_depth=5))
+    assert e.value.limit == 'max_depth'
+    data = make_dsn(recipients=1, depth=3)
+    assert len(feed(data, 1000, Limits(max_depth=3))[0]) == 1
@@ -0,0 +1,61 @@
+from pkg_resources import resource_stream
+
+
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+def test_instrumented():
+    from bounced import bounced
+    from bounced import get_bounces_from_bytes
+    from bounced.instrumentation import instrumented
+    with instrumented() as stats:
+        for fn in ('tests/flufl_bounce/dsn_02.eml',
+                   'tests/flufl_bounce/dsn_09.eml',
+                   'tests/flufl_bounce/netscape_01.eml',
+                   'tests/bounces/local-address.eml',
+                   'tests/flufl_bounce/qmail_01.eml'):
+            get_bounces_from_bytes(get_bytes(fn))
+    assert bounced.instrumentation is None
+    assert stats.outcomes == {'bounces': 3, 'empty': 1, 'none': 1}
+    assert stats.recipient_kinds['x400'] == 2
+    assert stats.recipient_kinds['local'] == 1
+    assert stats.calls['locate'] >= 5
+    assert stats.calls['fields'] == 5
+    result = stats.as_dict()
+    assert result['outcome.bounces'] == 3
+    assert result['stage.fields.calls'] == 5
+    assert result['stage.fields.seconds'] >= 0
+
+
+def test_instrumented_errors():
+    from bounced import get_bounces_from_bytes
+    from bounced.instrumentation import instrumented
+    import pytest
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml').replace(
+        b'Status: 5.0.0', b'Status: 5.0')
+    with instrumented() as stats:
+        with pytest.raises(ValueError):
+            get_bounces_from_bytes(data)
+    assert stats.errors == {'status': 1}
+    assert stats.outcomes == {'error': 1}
+
+
+def test_custom_hooks():
+    from bounced import get_bounces_from_bytes
+    from bounced.instrumentation import Stats
+    from bounced.instrumentation import instrumented
+
+    class Recorder(Stats):
+        def __init__(self):
+            Stats.__init__(self)
+            self.seen = []
+
+        def timing(self, name, seconds):
+            self.seen.append(name)
+
+    with instrumented(Recorder()) as stats:
+        get_bounces_from_bytes(get_bytes('tests/flufl_bounce/dsn_02.eml'))
+    assert stats.seen == ['locate', 'fields']
+    assert stats.timers == {}
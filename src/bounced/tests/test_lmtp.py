@@ -0,0 +1,163 @@
+from pkg_resources import resource_stream
+import asyncio
+
+
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+def run_session(commands, max_size=None, callback=None, limits=None):
+    from bounced.lmtp import BounceSink
+    results = []
+
+    async def collect(envelope, bounces, error):
+        results.append((envelope, bounces, error))
+
+    async def session():
+        sink = BounceSink(
+            callback or collect, hostname='sink.example.com', max_size=max_size,
+            limits=limits)
+        server = await sink.start_server(host='127.0.0.1', port=0)
+        port = server.sockets[0].getsockname()[1]
+        (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            replies = [await asyncio.wait_for(reader.readline(), 5)]
+            for command, count in commands + [(b'QUIT\r\n', 1)]:
+                writer.write(command)
+                for i in range(count):
+                    replies.append(await asyncio.wait_for(reader.readline(), 5))
+            # the server closes the connection after QUIT
+            assert await asyncio.wait_for(reader.read(), 5) == b''
+        finally:
+            writer.close()
+            server.close()
+        return [x.decode('ascii').rstrip('\r\n') for x in replies]
+
+    loop = asyncio.new_event_loop()
+    try:
+        return (loop.run_until_complete(session()), results)
+    finally:
+        loop.close()
+
+
+def as_data(data):
+    lines = data.splitlines(True)
+    lines = [b'.' + x if x.startswith(b'.') else x for x in lines]
+    if not lines[-1].endswith(b'\n'):
+        lines.append(b'\r\n')
+    return b''.join(lines) + b'.\r\n'
+
+
+def test_lmtp_bounce():
+    from bounced import get_bounces_from_bytes
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    (replies, results) = run_session([
+        (b'LHLO client\r\n', 4),
+        (b'MAIL FROM:<>\r\n', 1),
+        (b'RCPT TO:<bounces@example.com>\r\n', 1),
+        (b'RCPT TO:<other@example.com>\r\n', 1),
+        (b'DATA\r\n', 1),
+        (as_data(data), 2)])
+    assert replies[0].startswith('220 sink.example.com')
+    assert replies[1:5] == [
+        '250-sink.example.com', '250-8BITMIME',
+        '250-ENHANCEDSTATUSCODES', '250 PIPELINING']
+    assert replies[-3:] == ['250 2.0.0 Ok', '250 2.0.0 Ok', '221 2.0.0 Bye']
+    [(envelope, bounces, error)] = results
+    assert envelope.mail_from == ''
+    assert envelope.rcpt_tos == ['bounces@example.com', 'other@example.com']
+    assert envelope.data.replace(b'\r\n', b'\n') == data.replace(b'\r\n', b'\n')
+    assert error is None
+    assert bounces == get_bounces_from_bytes(data)
+
+
+def test_smtp_non_bounce_and_rset():
+    (replies, results) = run_session([
+        (b'EHLO client\r\n', 4),
+        (b'DATA\r\n', 1),
+        (b'MAIL FROM:<a@example.com>\r\n', 1),
+        (b'RSET\r\n', 1),
+        (b'MAIL FROM:<a@example.com> SIZE=10\r\n', 1),
+        (b'RCPT TO:<x@example.com>\r\n', 1),
+        (b'RCPT TO:<y@example.com>\r\n', 1),
+        (b'DATA\r\n', 1),
+        (b'Subject: hi\r\n\r\n..dotted\r\n.\r\n', 1)])
+    assert replies[5:] == [
+        '503 5.5.1 Need RCPT command', '250 2.1.0 Ok', '250 2.0.0 Ok',
+        '250 2.1.0 Ok', '250 2.1.5 Ok', '250 2.1.5 Ok',
+        '354 End data with <CR><LF>.<CR><LF>', '250 2.0.0 Ok',
+        '221 2.0.0 Bye']
+    [(envelope, bounces, error)] = results
+    assert envelope.data == b'Subject: hi\r\n\r\n.dotted\r\n'
+    assert bounces is None
+    assert error is None
+
+
+def test_lmtp_errors():
+    async def failing(envelope, bounces, error):
+        raise RuntimeError
+
+    (replies, results) = run_session([
+        (b'MAIL FROM:<>\r\n', 1),
+        (b'FOO\r\n', 1),
+        (b'LHLO client\r\n', 4),
+        (b'MAIL FROM:<>\r\n', 1),
+        (b'RCPT TO:<x@example.com>\r\n', 1),
+        (b'DATA\r\n', 1),
+        (b'Subject: hi\r\n\r\nfoo\r\n.\r\n', 1)], callback=failing)
+    assert replies[1:3] == [
+        '503 5.5.1 Send LHLO first', '500 5.5.1 Command unrecognized']
+    assert replies[-2] == '451 4.3.0 Error processing message'
+
+
+def test_lmtp_max_size():
+    (replies, results) = run_session([
+        (b'LHLO client\r\n', 5),
+        (b'MAIL FROM:<>\r\n', 1),
+        (b'RCPT TO:<x@example.com>\r\n', 1),
+        (b'DATA\r\n', 1),
+        (b'Subject: hi\r\n\r\n' + b'x' * 100 + b'\r\n.\r\n', 1),
+        (b'NOOP\r\n', 1)], max_size=50)
+    assert replies[5] == '250 SIZE 50'
+    assert replies[-3:-1] == ['552 5.3.4 Message too big', '250 2.0.0 Ok']
+    assert results == []
+
+
+def test_lmtp_limits():
+    from bounced import LimitExceeded
+    from bounced import Limits
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    (replies, results) = run_session([
+        (b'LHLO client\r\n', 4),
+        (b'MAIL FROM:<>\r\n', 1),
+        (b'RCPT TO:<x@example.com>\r\n', 1),
+        (b'DATA\r\n', 1),
+        (as_data(data), 1)], limits=Limits(max_fields=1))
+    assert replies[-2] == '250 2.0.0 Ok'
+    [(envelope, bounces, error)] = results
+    assert bounces is None
+    assert isinstance(error, LimitExceeded)
+    assert error.limit == 'max_fields'
+
+
+def test_lmtp_line_too_long():
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    long_line = b'<p>' + b'x' * 200000 + b'.\r\n'
+    (replies, results) = run_session([
+        (b'LHLO client\r\n', 4),
+        (b'MAIL FROM:<>\r\n', 1),
+        (b'RCPT TO:<x@example.com>\r\n', 1),
+        (b'RCPT TO:<y@example.com>\r\n', 1),
+        (b'DATA\r\n', 1),
+        (b'Subject: hi\r\n\r\n' + long_line + b'foo\r\n.\r\n', 2),
+        (b'MAIL FROM:<>\r\n', 1),
+        (b'RCPT TO:<x@example.com>\r\n', 1),
+        (b'DATA\r\n', 1),
+        (as_data(data), 1)])
+    assert replies[-7:-5] == [
+        '500 5.5.2 Line too long', '500 5.5.2 Line too long']
+    assert replies[-2] == '250 2.0.0 Ok'
+    [(envelope, bounces, error)] = results
+    assert error is None
+    assert bounces
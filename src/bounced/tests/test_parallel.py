@@ -0,0 +1,63 @@
+from pkg_resources import resource_filename
+import pytest
+
+
+fns = [
+    'tests/flufl_bounce/dsn_01.eml',
+    'tests/flufl_bounce/dsn_02.eml',
+    'tests/flufl_bounce/qmail_01.eml',
+    'tests/bounces/longer-status.eml',
+    'tests/bounce_email/non_bounces/tt_1234210666.eml']
+
+
+@pytest.fixture
+def paths():
+    return [resource_filename('bounced', fn) for fn in fns]
+
+
+@pytest.fixture
+def expected(paths):
+    from bounced import get_bounces_from_bytes
+    results = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            results.append(get_bounces_from_bytes(f.read()))
+    return results
+
+
+def test_classify_many_ordered(paths, expected):
+    from bounced.parallel import classify_many
+    items = paths + [b'garbage']
+    result = list(classify_many(items, workers=2, chunksize=2))
+    assert [x[0] for x in result] == list(range(len(items)))
+    assert [x[1] for x in result] == expected + [None]
+    assert all(x[2] is None for x in result)
+
+
+def test_classify_many_completed(paths, expected):
+    from bounced.parallel import classify_many
+    result = list(classify_many(paths, workers=2, chunksize=1, ordered=False))
+    assert sorted(x[0] for x in result) == list(range(len(paths)))
+    assert [x[1] for x in sorted(result, key=lambda x: x[0])] == expected
+
+
+def test_classify_many_missing_file(tmpdir):
+    from bounced.parallel import classify_many
+    [(index, result, error)] = classify_many(
+        [tmpdir.join('missing.eml').strpath], workers=1)
+    assert index == 0
+    assert result is None
+    assert isinstance(error, IOError)
+
+
+def test_classify_many_limits(paths, expected):
+    from bounced import LimitExceeded
+    from bounced import Limits
+    from bounced.parallel import classify_many
+    result = list(classify_many(
+        [b'x' * 100] + paths, workers=1, limits=Limits(max_size=5)))
+    assert [x[0] for x in result] == list(range(len(paths) + 1))
+    assert all(x[1] is None for x in result)
+    error = result[0][2]
+    assert isinstance(error, LimitExceeded)
+    assert (error.limit, error.value, error.maximum) == ('max_size', 100, 5)
@@ -0,0 +1,110 @@
+from bounced import Bounce
+import io
+import pickle
+import pytest
+import random
+
+
+bounces = {
+    Bounce(('', 'foo@example.com'), status='550', msg='unknown user', reporting_mta='mx.example.com'),
+    Bounce(('Bar', 'bar@example.com'), status='550', msg='unknown user', reporting_mta='mx.example.com'),
+    Bounce(None, status=None, action='delayed', msg='\udcff\xe4', reporting_mta=None),
+    Bounce(('', ''), status='', msg=''),
+    # from non utf-8 data decoded with surrogateescape
+    Bounce(('', 'x@example.com'), status='550', msg='\udcc3', reporting_mta='\udca4'),
+    Bounce(('', 'y@example.com'), status='550', msg='\udcc3\udca4 \xe4')}
+
+
+@pytest.mark.parametrize('obj', [None, set(), bounces] + sorted(bounces, key=repr))
+def test_roundtrip(obj):
+    from bounced.serialize import decode
+    from bounced.serialize import encode
+    assert decode(encode(obj)) == obj
+
+
+def test_string_table():
+    from bounced.serialize import decode
+    from bounced.serialize import encode
+    many = set(
+        Bounce(('', 'user%d@example.com' % i), status='550', reporting_mta='mx.example.com')
+        for i in range(70000))
+    data = encode(many)
+    assert data.count(b'mx.example.com') == 1
+    assert decode(data) == many
+    assert len(data) < len(pickle.dumps(many, pickle.HIGHEST_PROTOCOL))
+
+
+def test_dsn():
+    from bounced.benchmark import make_dsn
+    from bounced.bounced import get_delivery_status
+    from bounced.bounced import get_delivery_status_from_bytes
+    from bounced.bounced import message_from_bytes
+    from bounced.serialize import decode
+    from bounced.serialize import encode
+    data = make_dsn(recipients=3, original_size=1024)
+    for dsn in (get_delivery_status_from_bytes(data), get_delivery_status(message_from_bytes(data))):
+        result = decode(encode(dsn))
+        assert result.original is None
+        assert [dict(x) for x in result.fields] == [
+            {k.lower(): v for k, v in x.items()} for x in dsn.fields]
+        assert result.fields[1]['Final-Recipient'] == 'rfc822; user0.0@example0.com'
+        assert len(encode(dsn)) < 1024
+
+
+def test_stream():
+    from bounced.serialize import dump
+    from bounced.serialize import iter_load
+    f = io.BytesIO()
+    for bounce in sorted(bounces, key=repr):
+        dump(bounce, f)
+    dump(bounces, f)
+    dump(None, f)
+    f.seek(0)
+    assert list(iter_load(f)) == sorted(bounces, key=repr) + [bounces, None]
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'BNC',
+    b'XXX\x02N\x00\x01\x00\x01',
+    b'BNC\x01N\x00\x01\x00\x01',
+    b'BNC\x02X\x00\x01\x00\x01',
+    b'BNC\x02N\x00\x03\x00\x01',
+    b'BNC\x02N\x00\x01\x00\x03',
+    b'BNC\x02N\x00\x01\x00\x01\x00',
+    b'BNC\x02N\xff\xff\xff\xff\x7f',
+    b'BNC\x02N\x01\x01\x02\x05ab',
+    b'BNC\x02N\x01\x01\x03\x02ab\x01',
+    b'BNC\x02N\x01\x01\x01\x01\xff\x01',
+    b'BNC\x02B\x00\x01\x00\x01\x00\x00\x00\x00\x00',
+    b'BNC\x02B\x01\x01\x01\x01a\x01\x01\x00\x01\x01\x01\x01',
+    b'BNC\x02B\x01\x01\x01\x01a\x01\x00\x01\x01\x01\x01\x01',
+    b'BNC\x02B\x01\x01\x01\x01a\x01\x01\x01\x01\x01\x01\x02',
+    b'BNC\x02S\x00\x01\x00\xff\xff\xff\xff\x0f\x01',
+    b'BNC\x02D\x00\x01\x00\x01\x01\x01\x00\x00',
+    b'BNC\x02N' + b'\x80' * 20])
+def test_decode_errors(data):
+    from bounced.serialize import DecodeError
+    from bounced.serialize import decode
+    with pytest.raises(DecodeError):
+        decode(data)
+
+
+def test_decode_errors_fuzz():
+    from bounced.serialize import DecodeError
+    from bounced.serialize import decode
+    from bounced.serialize import encode
+    from bounced.serialize import iter_load
+    data = encode(bounces)
+    rnd = random.Random(0)
+    for i in range(2000):
+        corrupt = bytearray(data)
+        for j in range(rnd.randint(1, 3)):
+            corrupt[rnd.randrange(len(corrupt))] = rnd.randrange(256)
+        try:
+            decode(bytes(corrupt[:rnd.randint(0, len(corrupt))]))
+        except DecodeError:
+            pass
+    f = io.BytesIO(b'\x10BNC')
+    with pytest.raises(DecodeError):
+        list(iter_load(f))
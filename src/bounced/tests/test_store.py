@@ -0,0 +1,44 @@
+from bounced import Bounce
+import pytest
+
+
+@pytest.mark.parametrize('has_upsert', [True, False])
+def test_store(monkeypatch, tmpdir, has_upsert):
+    from bounced.store import BounceStore
+    monkeypatch.setattr('bounced.store.HAS_UPSERT', has_upsert)
+    path = tmpdir.join('bounces.db').strpath
+    with BounceStore(path) as store:
+        store.add([
+            Bounce(('', 'Foo@Example.com'), status='550', reporting_mta='mx1'),
+            Bounce(('', 'bar@example.com'), status='441', action='delayed'),
+            Bounce(None, status='500')], timestamp=10)
+        store.add_many([
+            ([Bounce(('', 'foo@example.com'), status='511', msg='gone')], 30),
+            ([Bounce(('', 'foo@example.com'), status='421', action='delayed')], 20),
+            ([Bounce(('', 'baz@example.org'), status='550')], None),
+            ([Bounce(('', 'foo@example.com'), status='550')], 25)])
+        assert len(store) == 3
+    with BounceStore(path) as store:
+        info = store.get(('', 'FOO@example.com'))
+        assert info.address == 'foo@example.com'
+        assert info.domain == 'example.com'
+        assert (info.count, info.hard_count) == (4, 3)
+        assert (info.first_seen, info.last_seen, info.last_hard_bounce) == (10, 30, 30)
+        assert (info.last_status, info.last_action, info.last_msg) == ('511', 'failed', 'gone')
+        assert info.last_reporting_mta is None
+        assert store.is_hard_bounced('foo@example.com')
+        assert not store.is_hard_bounced('bar@example.com')
+        assert not store.is_hard_bounced('unknown@example.com')
+        assert store.get('unknown@example.com') is None
+        assert [x.address for x in store.iter_domain('Example.COM')] == [
+            'bar@example.com', 'foo@example.com']
+
+
+def test_store_idn_domain():
+    from bounced.store import BounceStore
+    with BounceStore() as store:
+        store.add([Bounce(('', u'foo@B\xfccher.de'), status='550')], timestamp=10)
+        assert [x.address for x in store.iter_domain(u'b\xfccher.de')] == [
+            'foo@xn--bcher-kva.de']
+        assert [x.address for x in store.iter_domain('XN--BCHER-KVA.DE')] == [
+            'foo@xn--bcher-kva.de']
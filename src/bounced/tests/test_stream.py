@@ -0,0 +1,131 @@
+from pkg_resources import resource_stream
+import mailbox
+import pytest
+
+
+fns = [
+    'tests/flufl_bounce/dsn_01.eml',
+    'tests/flufl_bounce/qmail_01.eml',
+    'tests/bounces/longer-status.eml',
+    'tests/bounce_email/non_bounces/tt_1234210666.eml']
+
+
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+@pytest.fixture
+def expected():
+    from bounced import get_bounces_from_bytes
+    return [get_bounces_from_bytes(get_bytes(fn)) for fn in fns]
+
+
+def test_iter_bounces_streams(expected):
+    from bounced.stream import iter_bounces
+    streams = [resource_stream('bounced', fn) for fn in fns]
+    streams.append(b'garbage')
+    result = list(iter_bounces(streams))
+    assert [x[0] for x in result] == [0, 1, 2, 3, 4]
+    assert [x[1] for x in result] == expected + [None]
+    assert all(x[2] is None for x in result)
+
+
+def test_iter_bounces_mbox(tmpdir, expected):
+    from bounced.stream import iter_bounces
+    path = tmpdir.join('bounces.mbox').strpath
+    mb = mailbox.mbox(path)
+    for fn in fns:
+        mb.add(get_bytes(fn))
+    mb.close()
+    result = list(iter_bounces(path))
+    assert [x[1] for x in result] == expected
+
+
+def test_iter_bounces_maildir(tmpdir, expected):
+    from bounced.stream import iter_bounces
+    md = mailbox.Maildir(tmpdir.join('Maildir').strpath)
+    keys = [md.add(get_bytes(fn)) for fn in fns]
+    result = {x[0]: x[1] for x in iter_bounces(tmpdir.join('Maildir'))}
+    assert [result[key] for key in keys] == expected
+
+
+def test_iter_bounces_not_maildir(tmpdir):
+    from bounced.stream import iter_bounces
+    with pytest.raises(ValueError):
+        list(iter_bounces(tmpdir.strpath))
+
+
+def test_iter_bounces_error():
+    from bounced.stream import iter_bounces
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    # two Reporting-MTA groups are rejected by get_bounces
+    data = data.replace(
+        b'Reporting-MTA: dns;msg00.seamail.go.com\n',
+        b'Reporting-MTA: dns;msg00.seamail.go.com\n\nReporting-MTA: dns;example.com\n')
+    [(message_id, result, error)] = iter_bounces([data])
+    assert message_id == 0
+    assert result is None
+    assert isinstance(error, ValueError)
+
+
+def test_iter_mbox(tmpdir):
+    from bounced.stream import iter_mbox
+    path = tmpdir.join('bounces.mbox').strpath
+    mb = mailbox.mbox(path)
+    for fn in fns:
+        mb.add(get_bytes(fn))
+    mb.close()
+    mb = mailbox.mbox(path)
+    expected = [mb.get_bytes(x) for x in mb.iterkeys()]
+    mb.close()
+    result = list(iter_mbox(path))
+    assert all(isinstance(x[1], memoryview) for x in result)
+    assert [bytes(x[1]) for x in result] == expected
+    offsets = [x[0] for x in result]
+    assert offsets[0] == 0
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert all(data[x:x + 5] == b'From ' for x in offsets)
+    # resume at the third message
+    resumed = list(iter_mbox(path, offsets[2]))
+    assert [x[0] for x in resumed] == offsets[2:]
+    assert [bytes(x[1]) for x in resumed] == expected[2:]
+    with pytest.raises(ValueError):
+        list(iter_mbox(path, offsets[2] + 1))
+
+
+def test_iter_mbox_empty(tmpdir):
+    from bounced.stream import iter_mbox
+    path = tmpdir.join('empty.mbox')
+    path.write(b'')
+    assert list(iter_mbox(path.strpath)) == []
+    path.write(b'garbage\n')
+    assert list(iter_mbox(path.strpath)) == []
+
+
+def test_iter_bounces_mbox_offset(tmpdir, expected):
+    from bounced.stream import iter_bounces
+    path = tmpdir.join('bounces.mbox').strpath
+    mb = mailbox.mbox(path)
+    for fn in fns:
+        mb.add(get_bytes(fn))
+    mb.close()
+    result = list(iter_bounces(path))
+    resumed = list(iter_bounces(path, result[1][0]))
+    assert resumed == result[1:]
+    assert [x[1] for x in resumed] == expected[1:]
+    with pytest.raises(ValueError):
+        list(iter_bounces([b'garbage'], 10))
+
+
+def test_iter_bounces_limits():
+    from bounced import LimitExceeded
+    from bounced import Limits
+    from bounced.stream import iter_bounces
+    data = [get_bytes(fn) for fn in fns]
+    limits = Limits(max_size=min(len(x) for x in data))
+    result = list(iter_bounces(data, limits=limits))
+    errors = [isinstance(x[2], LimitExceeded) for x in result]
+    assert errors == [len(x) > limits.max_size for x in data]
+    assert errors.count(True) == 3
@@ -0,0 +1,73 @@
+from pkg_resources import resource_listdir
+from pkg_resources import resource_stream
+try:
+    from email import message_from_binary_file
+except ImportError:
+    from email import message_from_file as message_from_binary_file
+import pytest
+
+
+def get_email(fn):
+    with resource_stream('bounced', fn) as f:
+        return message_from_binary_file(f)
+
+
+def get_recipients(bounces):
+    return sorted((x.recipient[1], x.status, x.action) for x in bounces)
+
+
+@pytest.mark.parametrize('fn, recipients', [
+    ('exim_01', [('delangen@its.tudelft.nl', '553', 'failed')]),
+    ('microsoft_01', [('DJBENNETT@ikon.com', None, 'failed')]),
+    ('postfix_01', [('xxxxx@local.ie', '550', 'failed')]),
+    ('qmail_01', [('psadisc@wwwmail.n-h.de', None, 'failed')]),
+    ('qmail_05', [('ivokggrrdvc@caixaforte.freeservers.com', '550', 'failed')]),
+    ('sendmail_01', [
+        ('zzzzz@nfg.nl', '554', 'failed'),
+        ('zzzzz@shaft.coal.nl', None, 'failed')]),
+    ('simple_01', [('bbbsss@turbosport.com', '552', 'failed')]),
+    ('simple_03', [('jacobus@geo.co.za', None, 'delayed')]),
+    ('smtp32_01', [('oliver@pcworld.com.ph', None, 'failed')]),
+    ('smtp32_04', [
+        ('after_another@pacbell.net', '553', 'failed'),
+        ('one_bad_address@pacbell.net', '553', 'failed')]),
+    ('yahoo_01', [('subscribe.motorcycles@listsociety.com', '441', 'failed')]),
+    ('yahoo_04', [
+        ('agarciamartiartu@yahoo.es', None, 'failed'),
+        ('open00now@yahoo.co.uk', None, 'failed')])])
+def test_text_bounces(fn, recipients):
+    from bounced.text import get_text_bounces
+    bounces = get_text_bounces(get_email('tests/flufl_bounce/%s.eml' % fn))
+    assert get_recipients(bounces) == recipients
+
+
+def test_text_bounces_msg():
+    from bounced.text import get_text_bounces
+    (bounce,) = get_text_bounces(get_email('tests/flufl_bounce/yahoo_02.eml'))
+    assert bounce.msg == (
+        "Sorry, your message to agarciamartiartu@yahoo.es cannot be "
+        "delivered. This account is over quota.")
+    (bounce,) = get_text_bounces(get_email('tests/flufl_bounce/qmail_01.eml'))
+    assert bounce.msg is None
+
+
+def test_text_bounces_non_bounces():
+    from bounced.text import get_text_bounces
+    path = 'tests/bounce_email/non_bounces'
+    for fn in resource_listdir('bounced', path):
+        if fn.endswith('.eml'):
+            assert get_text_bounces(get_email(path + '/' + fn)) is None
+
+
+def test_text_bounces_scan_size():
+    from bounced.text import SCAN_SIZE
+    from bounced.text import get_text_bounces
+    from email import message_from_string
+    notice = (
+        "Unable to deliver message to the following address(es).\n\n"
+        "<foo@example.com>:\nSorry, no mailbox here by that name. (#5.1.1)\n")
+    msg = message_from_string("Subject: failure\n\n" + notice)
+    assert get_recipients(get_text_bounces(msg)) == [
+        ('foo@example.com', '511', 'failed')]
+    msg = message_from_string("Subject: failure\n\n" + "x" * SCAN_SIZE + notice)
+    assert get_text_bounces(msg) is None
@@ -0,0 +1,114 @@
+from pkg_resources import resource_stream
+import pytest
+
+
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+def get_verp_dsn(address):
+    data = get_bytes('tests/flufl_bounce/dsn_03.eml')
+    header = b'To: "python-list-admin@python.org" <python-list-admin@python.org>\n'
+    assert header in data
+    return data.replace(header, b'To: <' + address.encode('ascii') + b'>\n')
+
+
+@pytest.mark.parametrize('address, recipient', [
+    ('bounces+user=example.com@example.org', 'user@example.com'),
+    ('Bounces+First.Last=Example.COM@example.org', 'First.Last@example.com'),
+    ('bounces+a=b=example.com@example.org', 'a=b@example.com'),
+    ('bounces@example.org', None),
+    ('user@example.com', None)])
+def test_decode(address, recipient):
+    from bounced.verp import VERPDecoder
+    assert VERPDecoder().decode(address) == recipient
+
+
+def test_decode_patterns():
+    from bounced.verp import VERPDecoder
+    decoder = VERPDecoder(patterns=[
+        r'^bounce-(?P<local>[^-]+)-at-(?P<domain>[^@]+)@',
+        r'^bounces\+(?P<local>.+)=(?P<domain>[^=@]+)@'])
+    assert decoder.decode('bounce-user-at-example.com@example.org') == 'user@example.com'
+    assert decoder.decode('bounces+user=example.com@example.org') == 'user@example.com'
+    assert decoder.decode('user@example.com') is None
+
+
+def test_signed():
+    from bounced.verp import VERPDecoder
+    decoder = VERPDecoder(secret='secret')
+    address = decoder.encode('User@example.com', 'bounces', 'example.org')
+    assert address.startswith('bounces+User=example.com+')
+    assert decoder.decode(address) == 'User@example.com'
+    # case changed by a MTA
+    assert decoder.decode(address.lower()) == 'user@example.com'
+    forged = VERPDecoder(secret='other').encode('User@example.com', 'bounces', 'example.org')
+    assert decoder.decode(forged) is None
+    assert decoder.decode('bounces+user=example.com@example.org') is None
+
+
+def test_get_result(monkeypatch):
+    from bounced import bounced
+    from bounced.verp import VERPDecoder
+    data = get_verp_dsn('python-list-admin+ddd.kkk=advalvas.be@python.org')
+    calls = []
+    get_bounces_from_bytes = bounced.get_bounces_from_bytes
+    monkeypatch.setattr(
+        'bounced.verp.get_bounces_from_bytes',
+        lambda *args: calls.append(args) or get_bounces_from_bytes(*args))
+    decoder = VERPDecoder()
+    result = decoder.get_result(data)
+    assert result.recipient == 'ddd.kkk@advalvas.be'
+    assert calls == []
+    assert result.bounce.recipient == ('', 'ddd.kkk@advalvas.be')
+    assert result.status == result.bounce.status
+    assert result.action == result.bounce.action
+    assert result.reporting_mta == result.bounce.reporting_mta
+    assert result.msg == result.bounce.msg
+    assert len(calls) == 1
+    assert decoder.get_result(get_bytes('tests/flufl_bounce/dsn_03.eml')) is None
+
+
+def test_get_result_message():
+    from bounced.bounced import message_from_bytes
+    from bounced.verp import VERPDecoder
+    data = get_verp_dsn('python-list-admin+ddd.kkk=advalvas.be@python.org')
+    decoder = VERPDecoder()
+    expected = decoder.get_result(data).bounces
+    result = decoder.get_result(message_from_bytes(data))
+    assert result.recipient == 'ddd.kkk@advalvas.be'
+    assert result.bounces == expected
+    assert result.bounce.recipient == ('', 'ddd.kkk@advalvas.be')
+    msg = message_from_bytes(
+        b'To: bounces+user=example.com@example.org\n\nfoo\n')
+    result = decoder.get_result(msg)
+    assert result.recipient == 'user@example.com'
+    assert result.bounces == set()
+    assert result.bounce is None
+
+
+def test_get_recipient_message():
+    from bounced.bounced import message_from_bytes
+    from bounced.verp import VERPDecoder
+    decoder = VERPDecoder(headers=('to',))
+    data = get_verp_dsn('python-list-admin+ddd.kkk=advalvas.be@python.org')
+    assert decoder.get_recipient(data) == 'ddd.kkk@advalvas.be'
+    assert decoder.get_recipient(message_from_bytes(data)) == 'ddd.kkk@advalvas.be'
+    # only the top level headers are used
+    body = get_bytes('tests/flufl_bounce/dsn_03.eml').replace(
+        b"To: 'Ggggg Wwwww' <ggg@pppeval.be>",
+        b"To: list+ggg=pppeval.be@python.org")
+    assert decoder.get_recipient(body) is None
+
+
+def test_get_recipient_multiple_headers():
+    from bounced.bounced import message_from_bytes
+    from bounced.verp import VERPDecoder
+    decoder = VERPDecoder()
+    data = (
+        b'Delivered-To: bounces@example.org\n'
+        b'Delivered-To: bounces+user=example.com@example.org\n'
+        b'Subject: bounce\n\nfoo\n')
+    assert decoder.get_recipient(data) == 'user@example.com'
+    assert decoder.get_recipient(message_from_bytes(data)) == 'user@example.com'
@@ -0,0 +1,109 @@
+from pkg_resources import resource_stream
+import mailbox
+import os
+import pytest
+import threading
+import time
+
+
+def get_bytes(fn):
+    with resource_stream('bounced', fn) as f:
+        return f.read()
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def maildir(tmpdir):
+    return mailbox.Maildir(tmpdir.join('Maildir').strpath)
+
+
+@pytest.mark.parametrize('inotify', [True, False])
+def test_watcher(maildir, inotify):
+    from bounced import get_bounces_from_bytes
+    from bounced.watch import MaildirWatcher
+    data = get_bytes('tests/flufl_bounce/dsn_01.eml')
+    results = []
+    watcher = MaildirWatcher(
+        maildir._path, lambda *args: results.append(args),
+        inotify=inotify, poll_interval=0.01)
+    first = maildir.add(data)
+    thread = threading.Thread(target=watcher.run, kwargs=dict(timeout=0.05))
+    thread.start()
+    try:
+        wait_for(lambda: len(results) == 1)
+        assert results == [(first, get_bounces_from_bytes(data), None)]
+        second = maildir.add(b'garbage')
+        wait_for(lambda: len(results) == 2)
+        assert results[1] == (second, None, None)
+    finally:
+        watcher.stop()
+        thread.join(5)
+        watcher.close()
+    assert not thread.is_alive()
+    assert os.listdir(os.path.join(maildir._path, 'new')) == []
+    assert sorted(os.listdir(os.path.join(maildir._path, 'cur'))) == sorted(
+        [first + ':2,S', second + ':2,S'])
+    assert sorted(maildir.keys()) == sorted([first, second])
+    assert all(maildir.get_message(x).get_flags() == 'S' for x in (first, second))
+
+
+def test_watcher_checkpoint(maildir, tmpdir):
+    from bounced.watch import Checkpoint
+    from bounced.watch import MaildirWatcher
+    first = maildir.add(b'Subject: foo\n\nfoo')
+    second = maildir.add(b'Subject: bar\n\nbar')
+    path = tmpdir.join('checkpoint').strpath
+    checkpoint = Checkpoint(path)
+    # crashed after the checkpoint was written, but before the move
+    checkpoint.add(first)
+    checkpoint.add('long-gone')
+    checkpoint.close()
+    results = []
+    # names of files no longer in new/ are dropped from the checkpoint
+    watcher = MaildirWatcher(
+        maildir._path, lambda *args: results.append(args),
+        checkpoint=path, inotify=False)
+    watcher.source.read = lambda timeout: watcher.stop() or []
+    watcher.run()
+    watcher.close()
+    assert results == [(second, None, None)]
+    assert os.listdir(os.path.join(maildir._path, 'new')) == []
+    with open(path) as f:
+        assert f.read().split() == [first, second]
+
+
+def test_watcher_checkpoint_compacted(maildir, tmpdir):
+    from bounced.watch import Checkpoint
+    from bounced.watch import MaildirWatcher
+    path = tmpdir.join('checkpoint').strpath
+    results = []
+    watcher = MaildirWatcher(
+        maildir._path, lambda *args: results.append(args),
+        checkpoint=Checkpoint(path, compact_size=3), inotify=False)
+    for i in range(10):
+        watcher.process(maildir.add(b'Subject: foo\n\n%d' % i))
+        assert len(watcher.checkpoint.names) == 0
+        with open(path) as f:
+            assert len(f.read().split()) <= 3
+    watcher.close()
+    assert len(results) == 10
+    assert os.listdir(os.path.join(maildir._path, 'new')) == []
+
+
+def test_watcher_not_maildir(tmpdir):
+    from bounced.watch import MaildirWatcher
+    with pytest.raises(ValueError):
+        MaildirWatcher(tmpdir, None)
+
+
+def test_get_cur_name():
+    from bounced.watch import get_cur_name
+    assert get_cur_name('123.foo', 'S') == '123.foo:2,S'
+    assert get_cur_name('123.foo:2,RF', 'S') == '123.foo:2,FRS'
+    assert get_cur_name('123.foo:2,S', 'S') == '123.foo:2,S'
@@ -0,0 +1,152 @@
+from .address import normalize_address
+from .bounced import Bounce
+import email.utils
+import re
+
+
+# only the beginning of the notice is scanned, the markers are in the
+# first few lines of all known formats
+SCAN_SIZE = 8192
+REGION_SIZE = 4096
+
+
+# All markers are combined into one alternation, so a message which isn't
+# a bounce costs a single scan. The name of the matching group is the
+# action of the resulting bounces.
+_markers = dict(
+    failed=(
+        # qmail, yahoo and derivatives
+        r"(?:wasn't|was not|was unable|unable) (?:able )?to deliver (?:your )?message"
+        r" to the following address",
+        r"your mail was not delivered to the following address",
+        r"to the following address(?:es|\(es\))? could not be delivered",
+        r"there's a problem with the e-mail address",
+        # exim
+        r"following\s+address(?:es|\(es\))?\s+failed",
+        # postfix
+        r"could not be delivered to one or more destinations",
+        # groupwise and exchange
+        r"did not reach the following recipient",
+        # smtp32
+        r"delivery failed \d+ attempts:",
+        r"undeliverable\s+to\s",
+        r"unknown user:",
+        r"invalid final delivery userid:",
+        # sendmail, mdaemon and smail
+        r"permanent fatal (?:delivery )?errors",
+        r"the following addresses did not receive a copy",
+        r"failed addresses follow:"),
+    delayed=(
+        r"has not yet been delivered",
+        r"delivery (?:has been|is) delayed",
+        r"this is (?:only|just) a warning"))
+
+
+_marker_re = re.compile('|'.join(
+    '(?P<%s>%s)' % (name, '|'.join(patterns))
+    for name, patterns in sorted(_markers.items())), re.IGNORECASE)
+_end_re = re.compile(
+    r"^[ \t|-]*(?:below this line is a copy"
+    r"|original message follows"
+    r"|this is a copy of the message"
+    r"|the header of the original message"
+    r"|message text follows"
+    r"|returned mail follows"
+    r"|message header follows"
+    r"|copy of the message header)"
+    # headers of the returned message without any separator
+    r"|^(?:received|return-path|content-type|message-id):", re.IGNORECASE | re.MULTILINE)
+_address_re = re.compile(
+    r"(?<![\w.+=-])([\w.+=-]+@(?:[\w-]+\.)+[a-z]{2,})(?![\w-])", re.IGNORECASE)
+_code_re = re.compile(
+    r"(?<![\w.#])([45]\d\d)(?=[\s-])"
+    r"|(?<![\w.])#?([45])\.(\d{1,3})\.(\d{1,3})(?![\w.])")
+_paragraph_re = re.compile(r"\n[ \t]*\n")
+_tag_re = re.compile(r"<[a-z/!][^>]*>", re.IGNORECASE)
+_ignored_locals = frozenset(('postmaster', 'mailer-daemon'))
+
+
+def iter_text(msg):
+    # the text parts of the notice itself, the returned message is skipped
+    for part in msg.walk():
+        content_type = part.get_content_type()
+        if content_type in ('message/rfc822', 'text/rfc822-headers'):
+            break
+        if content_type not in ('text/plain', 'text/html'):
+            continue
+        payload = part.get_payload(decode=True)
+        if not payload:
+            continue
+        text = payload[:SCAN_SIZE].decode('latin-1')
+        if content_type == 'text/html':
+            text = _tag_re.sub(' ', text).replace('&nbsp;', ' ')
+        yield text
+
+
+def get_region(text):
+    match = _marker_re.search(text)
+    if match is None:
+        return (None, None)
+    start = match.start()
+    end = _end_re.search(text, match.end(), start + REGION_SIZE)
+    if end is None:
+        return (match.lastgroup, text[start:start + REGION_SIZE])
+    return (match.lastgroup, text[start:end.start()])
+
+
+def get_status(segment):
+    status = None
+    for match in _code_re.finditer(segment):
+        if match.group(1):
+            return match.group(1)
+        if status is None:
+            status = ''.join(match.group(2, 3, 4))
+    return status
+
+
+def get_msg(segment):
+    for paragraph in _paragraph_re.split(segment):
+        msg = ' '.join(paragraph.split()).lstrip(':>. ')
+        if msg:
+            return msg
+
+
+def iter_recipients(region, ignored=()):
+    # yields each address with the text up to the next new address
+    ignored = set(x.lower() for x in ignored)
+    current = None
+    for match in _address_re.finditer(region):
+        addr = match.group(1)
+        if addr[:5].lower() == 'smtp=':
+            # exchange puts the address type in front
+            addr = addr[5:]
+        if addr.lower() in ignored:
+            continue
+        if addr.split('@', 1)[0].lower() in _ignored_locals:
+            continue
+        if current is not None:
+            yield (current[0], region[current[1]:match.start()])
+        ignored.add(addr.lower())
+        current = (addr, match.end())
+    if current is not None:
+        yield (current[0], region[current[1]:])
+
+
+def get_text_bounces(msg):
+    # Heuristic for the plain text notices of MTAs which don't send
+    # delivery status reports. Returns None if no marker is found.
+    # The notice is sent to the envelope sender, which often shows up
+    # in transcripts, so the addresses it is sent to are ignored.
+    ignored = [x[1] for x in email.utils.getaddresses(msg.get_all('to', []))]
+    for text in iter_text(msg):
+        (action, region) = get_region(text)
+        if region is None:
+            continue
+        bounces = set()
+        for addr, segment in iter_recipients(region, ignored):
+            bounces.add(Bounce(
+                recipient=('', normalize_address(addr)),
+                status=get_status(segment),
+                action=action,
+                msg=get_msg(segment)))
+        return bounces
@@ -0,0 +1,130 @@
+from .address import normalize_address
+from .bounced import get_bounces
+from .bounced import get_bounces_from_bytes
+from .bounced import parse_headers
+import email.utils
+import hashlib
+import hmac
+import re
+
+
+# bounces+user=example.com@example.org
+DEFAULT_PATTERN = r'^(?P<prefix>[^+@]+)\+(?P<local>.+)=(?P<domain>[^=@]+)@(?P<host>[^@]+)$'
+# bounces+user=example.com+1a2b3c4d5e6f@example.org
+SIGNED_PATTERN = (
+    r'^(?P<prefix>[^+@]+)\+(?P<local>.+)=(?P<domain>[^=@+]+)'
+    r'\+(?P<signature>[0-9a-f]+)@(?P<host>[^@]+)$')
+DEFAULT_HEADERS = ('x-original-to', 'delivered-to', 'to')
+
+
+class VERPDecoder(object):
+    # Finds the recipient encoded in the address a bounce was sent to.
+    # Patterns need the named groups "local" and "domain". If a secret is
+    # given, patterns also need a "signature" group, which has to match
+    # the HMAC of the recipient, so forged bounces are ignored.
+
+    def __init__(self, patterns=None, secret=None, headers=DEFAULT_HEADERS,
+                 digestmod=hashlib.sha256, signature_length=12):
+        if patterns is None:
+            patterns = (DEFAULT_PATTERN,) if secret is None else (SIGNED_PATTERN,)
+        self.patterns = [
+            re.compile(x, re.IGNORECASE) if isinstance(x, str) else x
+            for x in patterns]
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self.secret = secret
+        self.headers = tuple(x.lower() for x in headers)
+        self.names = tuple(x.encode('ascii') for x in self.headers)
+        self.digestmod = digestmod
+        self.signature_length = signature_length
+
+    def sign(self, recipient):
+        # MTAs might change the case of addresses, so the signature is
+        # calculated from the lowercased recipient and in lowercase hex
+        mac = hmac.new(
+            self.secret, recipient.lower().encode('utf-8'), self.digestmod)
+        return mac.hexdigest()[:self.signature_length]
+
+    def encode(self, recipient, prefix, host):
+        (local, sep, domain) = recipient.rpartition('@')
+        address = '%s+%s=%s' % (prefix, local, domain)
+        if self.secret is not None:
+            address = '%s+%s' % (address, self.sign(recipient))
+        return '%s@%s' % (address, host)
+
+    def decode(self, address):
+        for pattern in self.patterns:
+            match = pattern.match(address.strip())
+            if match is None:
+                continue
+            recipient = '%s@%s' % match.group('local', 'domain')
+            if self.secret is not None:
+                signature = match.group('signature').lower()
+                if not hmac.compare_digest(signature, self.sign(recipient)):
+                    continue
+            return normalize_address(recipient)
+
+    def get_recipient(self, msg):
+        # accepts the raw bytes of the message or an email.message.Message,
+        # for bytes only the top level headers are parsed
+        if isinstance(msg, (bytes, bytearray, memoryview)):
+            (msg, body_start) = parse_headers(msg, names=self.names)
+        for name in self.headers:
+            for value in msg.get_all(name, ()):
+                for realname, address in email.utils.getaddresses([str(value)]):
+                    recipient = self.decode(address)
+                    if recipient is not None:
+                        return recipient
+
+    def get_result(self, data, limits=None):
+        recipient = self.get_recipient(data)
+        if recipient is None:
+            return
+        return VERPResult(recipient, data, limits)
+
+
+class VERPResult(object):
+    # the recipient is known from the headers, the delivery status is
+    # only parsed when any of the details are accessed
+
+    def __init__(self, recipient, data, limits=None):
+        self.recipient = recipient
+        self.data = data
+        self.limits = limits
+        self._bounces = None
+
+    @property
+    def bounces(self):
+        if self._bounces is None:
+            if isinstance(self.data, (bytes, bytearray, memoryview)):
+                bounces = get_bounces_from_bytes(self.data, self.limits)
+            else:
+                bounces = get_bounces(self.data, self.limits)
+            self._bounces = bounces or set()
+        return self._bounces
+
+    @property
+    def bounce(self):
+        # the bounce for the decoded recipient, or the only one
+        recipient = self.recipient.lower()
+        for bounce in self.bounces:
+            if bounce.recipient and bounce.recipient[1].lower() == recipient:
+                return bounce
+        if len(self.bounces) == 1:
+            return next(iter(self.bounces))
+
+    @property
+    def action(self):
+        return getattr(self.bounce, 'action', None)
+
+    @property
+    def status(self):
+        return getattr(self.bounce, 'status', None)
+
+    @property
+    def msg(self):
+        return getattr(self.bounce, 'msg', None)
+
+    @property
+    def reporting_mta(self):
+        return getattr(self.bounce, 'reporting_mta', None)
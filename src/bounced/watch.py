@@ -0,0 +1,247 @@
+from .bounced import get_bounces_from_bytes
+from .stream import is_maildir
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_event_header = struct.Struct('iIII')
+
+
+class Inotify(object):
+    # Minimal inotify binding, only watching a single directory. Files
+    # are hard linked or renamed into new/ of a Maildir when complete.
+
+    def __init__(self, path, mask=IN_CREATE | IN_MOVED_TO):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), path)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def read(self, timeout=None):
+        # returns the names of the changed files, None if the kernel
+        # dropped events and the directory has to be scanned again
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        names = []
+        pos = 0
+        while pos < len(data):
+            (wd, mask, cookie, length) = _event_header.unpack_from(data, pos)
+            pos += _event_header.size
+            if mask & IN_Q_OVERFLOW:
+                return
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+
+class Poller(object):
+    # Fallback for systems without inotify. The directory is only listed
+    # when its modification time changed, so an idle Maildir costs a
+    # single stat call per interval.
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.mtime = None
+
+    def fileno(self):
+        return
+
+    def close(self):
+        pass
+
+    def read(self, timeout=None):
+        if timeout is not None:
+            time.sleep(min(timeout, self.interval))
+        else:
+            time.sleep(self.interval)
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime and time.time() - mtime / 1e9 > 2:
+            # recent changes might share the timestamp on file systems
+            # with coarse resolution
+            return []
+        self.mtime = mtime
+        return
+
+
+class Checkpoint(object):
+    # Append only log of the processed file names. A name is added before
+    # the file is moved out of new/, so after a crash in between the file
+    # is only moved, not processed again. Once the file is moved the name
+    # is discarded, the log is rewritten when it has more than
+    # ``compact_size`` lines and most of them are stale.
+
+    def __init__(self, path, fsync=False, compact_size=1000):
+        self.path = path
+        self.fsync = fsync
+        self.compact_size = compact_size
+        self.names = set()
+        self.lines = 0
+        if os.path.exists(path):
+            with open(path, encoding='utf-8', errors='surrogateescape') as f:
+                for line in f:
+                    self.names.add(line.rstrip('\n'))
+                    self.lines += 1
+            self.names.discard('')
+        self.file = open(path, 'a', encoding='utf-8', errors='surrogateescape')
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def add(self, name):
+        self.file.write(name + '\n')
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.names.add(name)
+        self.lines += 1
+
+    def discard(self, name):
+        self.names.discard(name)
+        if self.lines > max(self.compact_size, 2 * len(self.names)):
+            self.compact()
+
+    def compact(self, keep=None):
+        # only names of files which are still in new/ need to be kept
+        if keep is not None:
+            self.names.intersection_update(keep)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8', errors='surrogateescape') as f:
+            for name in sorted(self.names):
+                f.write(name + '\n')
+        self.file.close()
+        os.replace(tmp, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8', errors='surrogateescape')
+        self.lines = len(self.names)
+
+    def close(self):
+        self.file.close()
+
+
+def get_cur_name(name, flag):
+    (name, sep, info) = name.partition(':2,')
+    flags = set(info)
+    flags.add(flag)
+    return '%s:2,%s' % (name, ''.join(sorted(flags)))
+
+
+class MaildirWatcher(object):
+    # Classifies files arriving in new/ of a Maildir and moves them to
+    # cur/ with the given flag. The callback is called with the file
+    # name, the bounces and the error like the items of iter_bounces.
+
+    def __init__(self, path, callback, checkpoint=None, flag='S',
+                 inotify=None, poll_interval=1.0, limits=None):
+        if hasattr(path, '__fspath__'):
+            path = path.__fspath__()
+        if not is_maildir(path):
+            raise ValueError("Not a Maildir: %s" % path)
+        self.path = path
+        self.new = os.path.join(path, 'new')
+        self.cur = os.path.join(path, 'cur')
+        self.callback = callback
+        if checkpoint is None:
+            checkpoint = os.path.join(path, 'bounced-checkpoint')
+        if not isinstance(checkpoint, Checkpoint):
+            checkpoint = Checkpoint(checkpoint)
+        self.checkpoint = checkpoint
+        self.flag = flag
+        self.limits = limits
+        self.running = False
+        if inotify is None:
+            inotify = sys.platform.startswith('linux')
+        self.source = None
+        if inotify:
+            try:
+                self.source = Inotify(self.new)
+            except (AttributeError, OSError):
+                pass
+        if self.source is None:
+            self.source = Poller(self.new, poll_interval)
+
+    def close(self):
+        self.source.close()
+        self.checkpoint.close()
+
+    def move(self, name):
+        try:
+            os.rename(
+                os.path.join(self.new, name),
+                os.path.join(self.cur, get_cur_name(name, self.flag)))
+        except FileNotFoundError:
+            pass
+        # the file isn't in new/ anymore
+        self.checkpoint.discard(name)
+
+    def process(self, name):
+        if name.startswith('.'):
+            return
+        if name in self.checkpoint:
+            self.move(name)
+            return
+        try:
+            with open(os.path.join(self.new, name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            # already processed or removed by someone else
+            return
+        try:
+            result = get_bounces_from_bytes(data, self.limits)
+        except Exception as e:
+            self.callback(name, None, e)
+        else:
+            self.callback(name, result, None)
+        self.checkpoint.add(name)
+        self.move(name)
+
+    def scan(self):
+        for name in sorted(os.listdir(self.new)):
+            self.process(name)
+
+    def poll(self, timeout=None):
+        names = self.source.read(timeout)
+        if names is None:
+            self.scan()
+            return
+        for name in names:
+            self.process(name)
+
+    def run(self, timeout=1.0):
+        # processes what arrived while not running, then waits for new
+        # files until stop is called
+        self.checkpoint.compact(os.listdir(self.new))
+        self.scan()
+        self.running = True
+        while self.running:
+            self.poll(timeout)
+
+    def stop(self):
+        self.running = False